@@ -0,0 +1,68 @@
+import logging
+import math
+from pathlib import Path
+
+import click
+
+from src import config
+from src.utils.loudness import Loudness
+from src.utils.working_directory import WorkingDirectory
+
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+def measure_shifts(working_directory: WorkingDirectory) -> list[tuple[float, int, float]]:
+    # (octaves of speed, reverb, loudness shift) of every render against its source track
+    track = Loudness.measure(working_directory.get_track_path(raise_if_not_exists=True))
+    shifts = []
+
+    for path in working_directory.get_nightcore_paths(raise_if_not_exist=True):
+        speed, reverb = (working_directory.path_to_speed_and_reverb(path) + (0,))[:2]
+        shift = Loudness.measure(path).integrated - track.integrated
+        logger.info(f'{working_directory.get_path().name} {speed}% / {reverb}: {shift:+.2f} LU')
+        shifts.append((math.log2(speed / config.STANDARD_SPEED), reverb, shift))
+
+    return shifts
+
+
+def fit(shifts: list[tuple[float, int, float]]) -> tuple[float, float]:
+    # least squares of `shift = speed_shift * octaves + reverb_shift * reverb`, an unchanged render keeps its loudness
+    xx = sum(x * x for x, _, _ in shifts)
+    xr = sum(x * r for x, r, _ in shifts)
+    rr = sum(r * r for _, r, _ in shifts)
+    xy = sum(x * y for x, _, y in shifts)
+    ry = sum(r * y for _, r, y in shifts)
+
+    if abs(determinant := xx * rr - xr * xr) < 1e-9:
+        raise click.ClickException('Renders have to vary in both speed and reverb independently to fit the shifts')
+
+    return (xy * rr - ry * xr) / determinant, (ry * xx - xy * xr) / determinant
+
+
+@click.command(help="""
+Fit the loudness shifts of renders that loudness normalization of the `nightcore-to-video` step predicts instead of measuring.
+
+<working-directories>: Working directories of tracks with renders of the `create-nightcore` step, use several tracks and speed / reverb combinations
+""")
+@click.argument(
+    'working_directories',
+    type=click.Path(path_type=Path, exists=True, file_okay=False),
+    nargs=-1,
+    required=True,
+    metavar='[working-directories]',
+)
+def cli(working_directories: tuple[Path]):
+    shifts = [x for path in working_directories for x in measure_shifts(WorkingDirectory(path.resolve()))]
+    speed_shift, reverb_shift = fit(shifts)
+    error = math.sqrt(sum((y - speed_shift * x - reverb_shift * r) ** 2 for x, r, y in shifts) / len(shifts))
+
+    logger.info('')
+    logger.info(f'LOUDNESS_SPEED_SHIFT = {speed_shift:.2f}')
+    logger.info(f'LOUDNESS_REVERB_SHIFT = {reverb_shift:.3f}')
+    logger.info(f'RMS error: {error:.2f} LU over {len(shifts)} renders')
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,294 @@
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import click
+import ffmpeg
+from PIL import Image
+
+from src import config
+from src.steps.nightcore_to_video import Preset, nightcore_to_video
+from src.steps.upload_to_youtube import upload_to_youtube
+from src.utils.ledger import Ledger
+from src.utils.working_directory import WorkingDirectory
+
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+PROJECT_PATH = config.resolve_project_path('')
+BASELINE_PATH = Path(__file__).with_name('baseline.json')
+
+TRACK_NAME = 'Benchmark - Synthetic Track'
+COVER_NAME = '24_1_w'
+SPEEDS_AND_REVERBS = [(80, 20), (90, 10), (110, 0), (120, 0), (70, 30), (130, 0), (85, 15)]
+
+
+@dataclass(frozen=True)
+class Case:
+    duration: int
+    resolution: int
+    variants: int
+    ratio: str
+    preset: str
+
+    @property
+    def id(self) -> str:
+        return f'{self.preset}-{self.duration}s-{self.resolution}p-{self.variants}v-{self.ratio.replace(":", "x")}'
+
+    @property
+    def ratios(self) -> list[float]:
+        return [width / height for width, height in (map(float, x.split(':')) for x in self.ratio.split('+'))]
+
+
+@dataclass
+class Result:
+    wall_time: float
+    cpu_time: float
+    peak_rss: int
+    output_size: int
+    stage_times: dict[str, float]
+
+
+class LocalYouTube:
+    # stand-in for the `youtube` v3 service: consumes the upload in chunks at a fixed uplink speed
+    def __init__(self, uplink: float):
+        self.uplink = uplink
+        self.uploads = 0
+
+    def videos(self):
+        return self
+
+    def insert(self, part, body, media_body):
+        return LocalUpload(self, media_body)
+
+    def list(self, part, id):
+        return LocalResponse({'items': [{'processingDetails': {'processingStatus': 'succeeded'}}]})
+
+
+class LocalUpload:
+    def __init__(self, service: LocalYouTube, media):
+        self.service = service
+        self.media = media
+        self.offset = 0
+
+    def next_chunk(self):
+        chunk = self.media.getbytes(self.offset, min(self.media.chunksize(), config.BENCHMARK_UPLOAD_CHUNK_SIZE))
+        self.offset += len(chunk)
+        time.sleep(len(chunk) / self.service.uplink)
+
+        if self.offset < self.media.size():
+            return None, None
+
+        self.service.uploads += 1
+        return None, {'id': f'local-{self.service.uploads}'}
+
+
+class LocalResponse:
+    def __init__(self, response: dict):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+def create_synthetic_track(path: Path, duration: int):
+    (
+        ffmpeg
+        .input(f'sine=frequency=220:duration={duration},volume=0.5', f='lavfi')
+        .output(str(path), audio_bitrate='192k')
+        .global_args('-loglevel', 'error')
+        .run(overwrite_output=True)
+    )
+
+
+def create_synthetic_cover(path: Path, resolution: int):
+    # noise keeps x264 from encoding the cover into nothing
+    Image.effect_noise((resolution, resolution), 64).convert('RGB').save(path)
+
+
+def render_locally(working_directory: WorkingDirectory, speed: int, reverb: int):
+    # stand-in for the browser renderer of the `create-nightcore` step
+    audio = ffmpeg.input(str(working_directory.get_track_path(raise_if_not_exists=True))).audio
+    audio = audio.filter('asetrate', 44100 * speed / 100).filter('aresample', 44100)
+    if reverb: audio = audio.filter('aecho', 0.8, 0.7, 60, reverb / 50)
+
+    (
+        ffmpeg
+        .output(audio, str(working_directory.speed_and_reverb_to_path(speed, reverb, 'mp3')), audio_bitrate='192k')
+        .global_args('-loglevel', 'error')
+        .run(overwrite_output=True)
+    )
+
+
+def run_case(case: Case, uplink: float) -> dict:
+    stage_times = {}
+
+    with tempfile.TemporaryDirectory(prefix='nightcore-benchmark-') as directory:
+        directory = Path(directory)
+        create_synthetic_track(directory / f'{TRACK_NAME}.mp3', case.duration)
+        create_synthetic_cover(directory / f'{COVER_NAME}.png', case.resolution)
+
+        working_directory = WorkingDirectory(directory)
+        ledger = Ledger(directory / 'ledger.sqlite')
+
+        for stage, callback in [
+            ('create_nightcore', lambda: [render_locally(working_directory, *x) for x in SPEEDS_AND_REVERBS[:case.variants]]),
+            # every case calibrates `auto` on its own, with the uplink of the upload stand-in
+            ('nightcore_to_video', lambda: nightcore_to_video(
+                working_directory,
+                ledger,
+                preset=Preset(case.preset),
+                ratios=case.ratios,
+                calibration_path=directory / 'calibration.json',
+                uplink=uplink,
+            )),
+            ('upload_to_youtube', lambda: upload_to_youtube(
+                working_directory,
+                ledger,
+                uploaded_video_count=None,
+                daily_quota=sys.maxsize,
+                service=LocalYouTube(uplink),
+            )),
+        ]:
+            start_time = time.time()
+            callback()
+            stage_times[stage] = time.time() - start_time
+
+        output_size = sum(x.stat().st_size for x in working_directory.get_video_paths() + working_directory.get_ratio_video_paths())
+        ledger.close()
+
+    return {'output_size': output_size, 'stage_times': stage_times}
+
+
+def measure_case(case: Case, uplink: float) -> Result:
+    # every case runs in its own process, so `wait4` gives CPU time and peak RSS of the case and its `ffmpeg` children
+    start_time = time.time()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.pipeline', 'case', json.dumps(asdict(case)), '--uplink', str(uplink)],
+        cwd=PROJECT_PATH,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.time() - start_time
+
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise click.ClickException(f'Benchmark case failed: {case.id}')
+
+    output = json.loads(output)
+    return Result(
+        wall_time=wall_time,
+        cpu_time=usage.ru_utime + usage.ru_stime,
+        peak_rss=usage.ru_maxrss * 1024,
+        output_size=output['output_size'],
+        stage_times=output['stage_times'],
+    )
+
+
+def compare(case: Case, result: Result, baseline: dict, tolerance: float) -> list[str]:
+    if not (expected := baseline.get(case.id)):
+        return []
+
+    regressions = []
+
+    for key in ['wall_time', 'cpu_time', 'peak_rss', 'output_size']:
+        if getattr(result, key) > expected[key] * (1 + tolerance):
+            regressions.append(f'{key} {getattr(result, key) / expected[key] - 1:+.0%}')
+
+    return regressions
+
+
+def parse_list(value: str, type=str) -> list:
+    return [type(x) for x in value.split(',') if x]
+
+
+@click.group(help="""
+Synthetic end-to-end benchmark of the pipeline.
+""")
+def cli():
+    ...
+
+
+@cli.command(help="""
+Run the benchmark matrix and compare results with the stored baseline.
+""")
+@click.option('--durations', default='60,600', show_default=True, help='Track durations in seconds')
+@click.option('--resolutions', default='1080', show_default=True, help='Heights of square cover arts')
+@click.option('--variants', default='1,4', show_default=True, help='Amounts of speed / reverb variants')
+@click.option('--ratios', default='16:9', show_default=True, help='Video ratios in the form of `width:height`, join several with `+` to render them in one pass')
+@click.option(
+    '--presets',
+    default=','.join([Preset.ULTRA_FAST.value, Preset.MEDIUM.value]),
+    show_default=True,
+    help='`ffmpeg` presets',
+)
+@click.option('--uplink', type=float, default=config.BENCHMARK_UPLINK, show_default=True, help='Speed of the local upload stand-in in bytes per second')
+@click.option('--tolerance', type=float, default=config.BENCHMARK_TOLERANCE, show_default=True, help='Allowed relative regression')
+@click.option('--update-baseline', is_flag=True, help='Store results as the new baseline instead of comparing')
+def run(durations, resolutions, variants, ratios, presets, uplink, tolerance, update_baseline):
+    cases = [
+        Case(*x)
+        for x in itertools.product(
+            parse_list(durations, int),
+            parse_list(resolutions, int),
+            parse_list(variants, int),
+            parse_list(ratios),
+            parse_list(presets),
+        )
+    ]
+
+    if invalid := [x for x in cases if x.variants > len(SPEEDS_AND_REVERBS) or x.preset not in {y.value for y in Preset}]:
+        raise click.BadParameter(f'Unsupported cases: {", ".join(x.id for x in invalid)}')
+
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {'host': None, 'results': {}}
+
+    if not update_baseline and baseline['host'] not in (None, platform.node()):
+        logger.warning(f"Baseline was recorded on '{baseline['host']}', timings aren't comparable across hosts")
+
+    results = {}
+    regressed = []
+
+    logger.info(f'{"Case":<34} {"Wall":>8} {"CPU":>8} {"RSS (MB)":>9} {"Size (MB)":>9}  Regressions')
+
+    for preset, preset_cases in itertools.groupby(sorted(cases, key=lambda x: x.preset), key=lambda x: x.preset):
+        for case in preset_cases:
+            result = measure_case(case, uplink)
+            results[case.id] = asdict(result)
+            regressions = [] if update_baseline else compare(case, result, baseline['results'], tolerance)
+            if regressions: regressed.append(case)
+
+            logger.info(
+                f'{case.id:<34} {result.wall_time:>7.1f}s {result.cpu_time:>7.1f}s '
+                f'{result.peak_rss / 2 ** 20:>9.0f} {result.output_size / 2 ** 20:>9.1f}  '
+                f'{", ".join(regressions) if regressions else "-"}'
+            )
+
+    if update_baseline:
+        BASELINE_PATH.write_text(json.dumps({'host': platform.node(), 'results': baseline['results'] | results}, indent=2) + '\n')
+        logger.info(f'Baseline updated: {BASELINE_PATH}')
+
+    elif regressed:
+        raise click.ClickException(f'{len(regressed)} case(s) regressed beyond {tolerance:.0%}: {", ".join(x.id for x in regressed)}')
+
+
+@cli.command(hidden=True)
+@click.argument('case')
+@click.option('--uplink', type=float, default=config.BENCHMARK_UPLINK)
+def case(case, uplink):
+    logging.getLogger().setLevel(logging.WARNING)
+    click.echo(json.dumps(run_case(Case(**json.loads(case)), uplink)))
+
+
+if __name__ == '__main__':
+    cli()
@@ -10,6 +10,9 @@ VIDEO_EXTENSIONS = ['mp4']
 
 SPEED_REVERB_NAME_SEPARATOR = '_'
 NIGHTCORE_NAME_PATTERN = re.compile(rf'\d+(?:{SPEED_REVERB_NAME_SEPARATOR}\d+)?')
+RATIO_NAME_SEPARATOR = 'x'
+RATIO_NAME_MAX_DENOMINATOR = 32
+RATIO_VIDEO_NAME_PATTERN = re.compile(rf'{NIGHTCORE_NAME_PATTERN.pattern}{SPEED_REVERB_NAME_SEPARATOR}\d+{RATIO_NAME_SEPARATOR}\d+')
 
 METADATA_DISCOVERY_YEARS = list(range(23, 100))
 METADATA_DISCOVERY_SEASONS = [1, 2, 3, 4]
@@ -25,6 +28,27 @@ STANDARD_REVERB = 0
 MIN_VIDEO_RATIO = 16 / 9
 MAX_VIDEO_RATIO = 32 / 9
 
+VIDEO_FRAME_RATE = 25
+DEFAULT_CRF = 18
+SEGMENTATION_MIN_DURATION = 10 * 60
+SEGMENT_MIN_DURATION = 60
+
+FFMPEG_STALL_TIMEOUT = 60
+FFMPEG_PROGRESS_LOG_INTERVAL = 10
+
+LOUDNESS_CACHE_NAME = '.loudness.json'
+LOUDNESS_TARGET = -14  # LUFS, YouTube's playback reference
+LOUDNESS_TRUE_PEAK_LIMIT = -1  # dBTP
+# unfitted estimates, normalization isn't exposed on the command line until `benchmarks/fit_loudness.py` fits them against renders of nightcore.studio
+LOUDNESS_SPEED_SHIFT = 0.5  # LU per octave of speed, K-weighting favors the higher pitch of sped up versions
+LOUDNESS_REVERB_SHIFT = 0.08  # LU per reverb unit, added by the wet signal
+AUDIO_BITRATE = '256k'
+
+JOB_LEASE_TIMEOUT = 60
+JOB_HEARTBEATS_PER_LEASE = 6
+JOB_POLL_INTERVAL = 1
+JOB_QUEUE_TIMEOUT = 10 * 60  # without any worker running jobs of the queue, the step's jobs fail into the retries
+
 
 # upload-to-youtube
 def resolve_project_path(project_path: str) -> Path:
@@ -39,3 +63,40 @@ QUATH_SCOPES = [
     'https://www.googleapis.com/auth/youtube',
     'https://www.googleapis.com/auth/youtube.upload',
 ]
+
+YOUTUBE_DAILY_QUOTA = 10_000
+YOUTUBE_QUOTA_TIMEZONE = 'America/Los_Angeles'
+QUOTA_COSTS = {
+    'videos.insert': 1600,
+    'videos.list': 1,
+}
+QUOTA_RESET_MARGIN = 60
+PROCESSING_CHECK_INTERVAL = 5
+PROCESSING_QUOTA_RESERVE = 120  # `videos.list` polls reserved per upload, 10 minutes of processing
+
+
+# nightcore-to-video calibration
+CALIBRATION_CACHE_PATH = resolve_project_path('.calibration.json')
+CALIBRATION_DURATION = 10
+AUTO_PRESETS = ['ultrafast', 'superfast', 'fast', 'medium', 'slow']
+AUTO_CRFS = [18, 24, 30]
+AUTO_MIN_SSIM = 0.998  # of the uploaded ratio against the cover, still images stay close to 1 so the floor is tight
+CALIBRATION_DETAIL_STEP = 0.5  # bits of edge entropy, covers closer than this share a calibration
+DEFAULT_UPLINK = 2.5 * 2 ** 20
+UPLINK_HISTORY_DAYS = 30
+
+
+# ledger
+LEDGER_PATH = resolve_project_path('.ledger.sqlite')
+LEDGER_MAX_ATTEMPTS = 3
+
+
+# profiling
+PROFILE_SAMPLING_INTERVAL = 0.005
+PROFILE_REPORT_LINES = 40
+
+
+# benchmark
+BENCHMARK_UPLINK = 2.5 * 2 ** 20
+BENCHMARK_UPLOAD_CHUNK_SIZE = 2 ** 20
+BENCHMARK_TOLERANCE = 0.15
@@ -1,6 +1,7 @@
 import asyncio
 import inspect
 import logging
+import sys
 import time
 from enum import Enum, auto
 from pathlib import Path
@@ -10,9 +11,13 @@ import click
 
 from src import config
 from src.steps.create_nightcore import Reverb, Speed, SpeedsAndReverbs, create_nightcore
-from src.steps.nightcore_to_video import Preset, nightcore_to_video
+from src.steps.nightcore_to_video import Preset, SegmentationMode, nightcore_to_video
 from src.steps.upload_to_youtube import upload_to_youtube
-from src.utils import param_types
+from src.utils import param_types, profiling
+from src.utils.ledger import Ledger
+from src.utils.metrics import MetricsFormat, metrics
+from src.utils.scratch import Scratch
+from src.utils.utils import ExitCode, StepError
 from src.utils.working_directory import WorkingDirectory
 
 
@@ -100,6 +105,17 @@ Create slowed and nightcore versions of a track and upload them to YouTube.
     help='Select specific pipeline step',
     metavar='',
 )
+# storage
+@click.option(
+    '--scratch-directory',
+    '-sd',
+    type=click.Path(path_type=Path, exists=True, file_okay=False, writable=True),
+    help=(
+        'Write renders, segments and encodes to fast local storage (NVMe, tmpfs) '
+        'and move only finished files into the working directory'
+    ),
+    metavar='',
+)
 # create-nightcore
 @click.option(
     '--gui',
@@ -114,15 +130,37 @@ Create slowed and nightcore versions of a track and upload them to YouTube.
     type=click.Choice([x.value for x in Preset], case_sensitive=False),
     default=Preset.DEFAULT.value,
     show_default=True,
-    help='Set preset for the `ffmpeg` in the `nightcore-to-video` step',
+    help=(
+        'Set preset for the `ffmpeg` in the `nightcore-to-video` step. '
+        '`auto` calibrates presets and CRF on the cover and picks the fastest encode plus upload'
+    ),
 )
 @click.option(
     '--ratio',
     '-r',
+    'ratios',
     type=param_types.RatioParamType(min_ratio=config.MIN_VIDEO_RATIO, max_ratio=config.MAX_VIDEO_RATIO),
-    default='16:9',
+    multiple=True,
+    default=['16:9'],
     show_default=True,
-    help='Select a nightcore video ratio in the form of `width:height`',
+    help=(
+        'Select a nightcore video ratio in the form of `width:height`. '
+        'Repeat to render several ratios in one pass, the first one is uploaded and the rest get a `_<width>x<height>` name suffix'
+    ),
+    metavar='',
+)
+@click.option(
+    '--segmentation',
+    type=click.Choice([x.value for x in SegmentationMode], case_sensitive=False),
+    default=SegmentationMode.DEFAULT.value,
+    show_default=True,
+    help='Encode long videos in parallel segments. `auto` does it when there are fewer variants than cores',
+)
+@click.option(
+    '--queue-directory',
+    '-q',
+    type=click.Path(path_type=Path, file_okay=False, writable=True),
+    help='Submit encodes to the shared job queue in the directory instead of running them locally, see `src/worker.py`',
     metavar='',
 )
 # upload-to-youtube
@@ -133,6 +171,37 @@ Create slowed and nightcore versions of a track and upload them to YouTube.
     help='Select a subset of videos to upload. Positive / Negative integer N specifies index range [1:N] / [N:-1]',
     metavar='',
 )
+@click.option(
+    '--wait-for-quota',
+    '-w',
+    is_flag=True,
+    help='Wait for the daily YouTube quota to reset instead of carrying over the remaining uploads to the next run',
+)
+# metrics
+@click.option(
+    '--metrics',
+    '-m',
+    'metrics_path',
+    type=click.Path(path_type=Path, dir_okay=False, writable=True),
+    help='Export per-stage and per-variant metrics to the file',
+    metavar='',
+)
+@click.option(
+    '--metrics-format',
+    '-mf',
+    type=click.Choice([x.value for x in MetricsFormat], case_sensitive=False),
+    default=MetricsFormat.DEFAULT.value,
+    show_default=True,
+    help='Format of the metrics file: JSON lines (appended) or Prometheus textfile for node_exporter (replaced)',
+)
+# profiling
+@click.option(
+    '--profile',
+    'profile_directory',
+    type=click.Path(path_type=Path, file_okay=False, writable=True),
+    help='Profile every step into the directory: per-step `cProfile` reports and a merged flame graph in folded format',
+    metavar='',
+)
 def cli(**kwargs):
     asyncio.run(async_cli(**kwargs))
 
@@ -142,14 +211,24 @@ async def async_cli(
         speeds_and_reverbs: tuple[int],
         steps: param_types.RangeParamType.TYPE,
         step: int,
+        scratch_directory: Optional[Path],
         gui: bool,
         preset: str,
-        ratio: param_types.RatioParamType.TYPE,
+        ratios: tuple[param_types.RatioParamType.TYPE],
+        segmentation: str,
+        queue_directory: Optional[Path],
         uploaded_video_count: Optional[int],
+        wait_for_quota: bool,
+        metrics_path: Optional[Path],
+        metrics_format: str,
+        profile_directory: Optional[Path],
 ):
     # conversion + auxiliary stuff
     working_directory = WorkingDirectory(working_directory.resolve())
     preset = Preset(preset)
+    segmentation = SegmentationMode(segmentation)
+    metrics_format = MetricsFormat(metrics_format)
+    if profile_directory: profile_directory.mkdir(parents=True, exist_ok=True)
 
     def has_step(checked_step: Step):
         return checked_step.value in set(range(steps[0], steps[1] + 1) if not step else [step])
@@ -181,42 +260,97 @@ async def async_cli(
                 )
 
 
+    # partials of interrupted runs are removed before the track is looked up
+    scratch = Scratch(working_directory.get_path(), scratch_directory.resolve() if scratch_directory else None)
+
     # ensuring track and metadata are correct
-    logger.info(f"Track: '{working_directory.get_track_path(raise_if_not_exists=True).stem}' {working_directory.get_metadata().represent()}")
+    try:
+        logger.info(f"Track: '{working_directory.get_track_path(raise_if_not_exists=True).stem}' {working_directory.get_metadata().represent()}")
+    except Exception:
+        scratch.clear()
+        raise
 
 
     # steps
-    start_total_time = time.time()
-
-    for current_step, log_message, callback in [
-        (
-                Step.CREATE_NIGHTCORE,
-                'Creating nightcore',
-                lambda: create_nightcore(working_directory, speeds_and_reverbs, gui=gui),
-        ),
-        (
-                Step.NIGHTCORE_TO_VIDEO,
-                'Converting nightcore to video',
-                lambda: nightcore_to_video(working_directory, preset=preset, ratio=ratio),
-        ),
-        (
-                Step.UPLOAD_TO_YOUTUBE,
-                'Uploading to YouTube',
-                lambda: upload_to_youtube(working_directory, uploaded_video_count=uploaded_video_count),
-        ),
-    ]:
-        if has_step(current_step):
-            logger.info('')
-            logger.info(f'{current_step.value}. {log_message}')
-            start_time = time.time()
-
-            result = callback()
-            if inspect.isawaitable(result): await result
-
-            logger.info(f'Time: {int(time.time() - start_time):.0f}s')
+    ledger = Ledger()
+    track_name = working_directory.get_track_name()
+
+    try:
+        with metrics.span('total', track=track_name) as total_span:
+            for current_step, log_message, callback in [
+                (
+                        Step.CREATE_NIGHTCORE,
+                        'Creating nightcore',
+                        lambda: create_nightcore(working_directory, speeds_and_reverbs, ledger, gui=gui, scratch=scratch),
+                ),
+                (
+                        Step.NIGHTCORE_TO_VIDEO,
+                        'Converting nightcore to video',
+                        lambda: nightcore_to_video(
+                            working_directory,
+                            ledger,
+                            preset=preset,
+                            ratios=list(ratios),
+                            segmentation=segmentation,
+                            profile_directory=profile_directory,
+                            queue_directory=queue_directory.resolve() if queue_directory else None,
+                            scratch=scratch,
+                        ),
+                ),
+                (
+                        Step.UPLOAD_TO_YOUTUBE,
+                        'Uploading to YouTube',
+                        lambda: upload_to_youtube(
+                            working_directory,
+                            ledger,
+                            uploaded_video_count=uploaded_video_count,
+                            wait_for_quota=wait_for_quota,
+                        ),
+                ),
+            ]:
+                if has_step(current_step):
+                    logger.info('')
+                    logger.info(f'{current_step.value}. {log_message}')
+
+                    step_name = current_step.name.lower()
+
+                    try:
+                        with (
+                            metrics.span('step', step=step_name, track=track_name) as span,
+                            profiling.profile(profile_directory, step_name),
+                        ):
+                            result = callback()
+                            if inspect.isawaitable(result): await result
+                    except StepError as e:
+                        logger.error(str(e))
+                        sys.exit(ExitCode.GENERAL_ERROR)
+                    finally:
+                        if profile_directory: profiling.merge_step(profile_directory, step_name)
+
+                    logger.info(f'Time: {span.seconds:.1f}s')
+
+            if scratch.is_separate:
+                logger.info('')
+                logger.info(
+                    f'Scratch: {scratch.written / 2 ** 20:.1f}MB written, {scratch.promoted / 2 ** 20:.1f}MB moved to the working directory, '
+                    f'{scratch.saved / 2 ** 20:.1f}MB of working directory writes saved'
+                )
+                metrics.record(
+                    'scratch',
+                    total_span.started_at,
+                    time.time(),
+                    track=track_name,
+                    values={'written_bytes': scratch.written, 'promoted_bytes': scratch.promoted, 'saved_bytes': scratch.saved},
+                )
+
+    finally:
+        scratch.clear()
+        ledger.close()
+        if metrics_path: metrics.export(metrics_path, format=metrics_format)
+        if profile_directory: profiling.merge_flame_graph(profile_directory, [x.name.lower() for x in Step])
 
     logger.info('')
-    logger.info(f'Total: {int(time.time() - start_total_time):.0f}s')
+    logger.info(f'Total: {total_span.seconds:.1f}s')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,83 @@
+import logging
+import math
+import time
+from collections import defaultdict
+
+import click
+
+from src import config
+from src.utils.ledger import AttemptRecord, Ledger, Stage, Status
+
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+PERIOD_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V',
+    'month': '%Y-%m',
+}
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+def summarize(records: list[AttemptRecord]) -> str:
+    succeeded = [x for x in records if x.status is Status.SUCCEEDED]
+    failed = [x for x in records if x.status is Status.FAILED]
+    durations = [x.duration for x in succeeded]
+    total_size = sum(x.size or 0 for x in succeeded)
+    total_duration = sum(durations)
+
+    throughput = f'{total_size / total_duration / 2 ** 20:.2f}MB/s' if total_size and total_duration else '-'
+    p50 = f'{percentile(durations, 50):.1f}s' if durations else '-'
+    p95 = f'{percentile(durations, 95):.1f}s' if durations else '-'
+
+    return f'{len(succeeded):>5} {len(failed):>6} {total_size / 2 ** 20:>9.1f} {throughput:>10} {p50:>8} {p95:>8}'
+
+
+@click.command(help="""
+Report throughput and stage latency of previous runs from the job ledger.
+""")
+@click.option(
+    '--period',
+    '-p',
+    type=click.Choice(list(PERIOD_FORMATS)),
+    default='day',
+    show_default=True,
+    help='Group attempts by period',
+)
+@click.option(
+    '--days',
+    '-d',
+    type=click.IntRange(min=1),
+    default=30,
+    show_default=True,
+    help='Number of days to look back',
+    metavar='',
+)
+def report(period: str, days: int):
+    if not config.LEDGER_PATH.exists():
+        raise click.FileError(str(config.LEDGER_PATH), hint='ledger doesn\'t exist yet, run the pipeline first')
+
+    ledger = Ledger(config.LEDGER_PATH, read_only=True)
+    grouped = defaultdict(list)
+
+    for x in ledger.history(since=time.time() - days * 24 * 60 * 60):
+        if x.status is not Status.RUNNING:
+            grouped[time.strftime(PERIOD_FORMATS[period], time.localtime(x.started_at)), x.stage].append(x)
+
+    ledger.close()
+
+    logger.info(f'{"Period":<10} {"Stage":<10} {"Done":>5} {"Failed":>6} {"Size (MB)":>9} {"Throughput":>10} {"p50":>8} {"p95":>8}')
+    stage_order = list(Stage)
+
+    for (key, stage), records in sorted(grouped.items(), key=lambda x: (x[0][0], stage_order.index(x[0][1]))):
+        logger.info(f'{key:<10} {stage.value:<10} {summarize(records)}')
+
+
+if __name__ == '__main__':
+    report()
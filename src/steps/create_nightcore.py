@@ -2,10 +2,15 @@ import asyncio
 import logging
 from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Optional
 
 from playwright.async_api import BrowserContext, Page, async_playwright
 
 from src import config
+from src.utils.ledger import Ledger, Stage, Variant
+from src.utils.metrics import metrics
+from src.utils.scratch import Scratch
+from src.utils.utils import StepError
 from src.utils.working_directory import WorkingDirectory
 
 
@@ -79,38 +84,74 @@ class Downloader:
 async def _create_nightcore(
         context: BrowserContext,
         working_directory: WorkingDirectory,
+        path: Path,
         speed: Speed,
         reverb: Reverb,
         verbose=False,
 ):
     page = await context.new_page()
-    downloader = Downloader(page, directory=working_directory.get_path(raise_if_not_exists=True))
+    downloader = Downloader(page, directory=path.parent)
 
     def wrap_log(log: str):
         return f'{speed:>3}x{reverb:<2}: {log}'
 
-    await page.goto('https://nightcore.studio/')
+    try:
+        await page.goto('https://nightcore.studio/')
 
-    if verbose: logger.info('Uploading track')
-    await page.set_input_files('input[type="file"]', working_directory.get_track_path(raise_if_not_exists=True))
-    await (await page.wait_for_selector(Selector.PAUSE, timeout=5000)).click()
+        if verbose: logger.info('Uploading track')
+        await page.set_input_files('input[type="file"]', working_directory.get_track_path(raise_if_not_exists=True))
+        await (await page.wait_for_selector(Selector.PAUSE, timeout=5000)).click()
 
-    if verbose: logger.info('Setting up parameters')
-    await set_nightcore_parameters(page, speed=speed, reverb=reverb)
+        if verbose: logger.info('Setting up parameters')
+        await set_nightcore_parameters(page, speed=speed, reverb=reverb)
 
-    if verbose: logger.info('Downloading')
-    async with downloader.download_as(working_directory.speed_and_reverb_to_path(speed, reverb, 'mp3').name): await (await page.wait_for_selector(Selector.DOWNLOAD, timeout=1000)).click()
+        if verbose: logger.info('Downloading')
+        async with downloader.download_as(path.name): await (await page.wait_for_selector(Selector.DOWNLOAD, timeout=1000)).click()
 
-    await page.close()
+    finally:
+        # a failed attempt must not leave its page and download handler behind for the retry
+        await page.close()
+
+
+async def _create_nightcore_with_retries(
+        context: BrowserContext,
+        working_directory: WorkingDirectory,
+        ledger: Ledger,
+        scratch: Scratch,
+        speed: Speed,
+        reverb: Reverb,
+        verbose=False,
+):
+    variant = Variant(working_directory.get_track_name(), speed, reverb)
+    path = working_directory.speed_and_reverb_to_path(speed, reverb, 'mp3')
+    scratch_path = scratch.path_for(path)
+
+    while True:
+        try:
+            with ledger.attempt(variant, Stage.RENDER) as attempt, metrics.span(Stage.RENDER.value, variant) as span:
+                await _create_nightcore(context, working_directory, scratch_path, speed, reverb, verbose=verbose)
+                scratch.promote(scratch_path, path)
+                attempt.size = span.values['bytes'] = path.stat().st_size
+            return
+
+        except Exception as e:
+            if not ledger.can_retry(variant, Stage.RENDER):
+                raise StepError(f'{variant.represent()}: Rendering failed after {ledger.attempts(variant, Stage.RENDER)} attempts: {e}') from e
+
+            logger.warning(f'{variant.represent()}: Rendering failed, retrying: {e}')
+            scratch.discard(scratch_path)
 
 
 async def create_nightcore(
         working_directory: WorkingDirectory,
         speeds_and_reverbs: SpeedsAndReverbs,
+        ledger: Ledger,
         gui: bool = False,
+        scratch: Optional[Scratch] = None,
 ):
     setup_page_methods()
     remove_previous_nightcore(working_directory)
+    scratch = scratch or Scratch(working_directory.get_path())
 
     async with async_playwright() as p:
         context = await p.chromium.launch_persistent_context(
@@ -121,7 +162,7 @@ async def create_nightcore(
         )
         await asyncio.gather(
             *[
-                _create_nightcore(context, working_directory, *x, verbose=y)
+                _create_nightcore_with_retries(context, working_directory, ledger, scratch, *x, verbose=y)
                 for x, y in zip(
                     speeds_and_reverbs,
                     [True] + [False] * (len(speeds_and_reverbs) - 1),
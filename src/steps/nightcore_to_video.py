@@ -1,16 +1,26 @@
 import logging
+import math
 import multiprocessing
-import sys
+import re
+import tempfile
+import time
 import traceback
+from dataclasses import asdict, dataclass, field, replace
 from enum import Enum
 from pathlib import Path
-from typing import Self
+from typing import Optional, Self
 
 import ffmpeg
 from PIL import Image
 
 from src import config
-from src.utils.utils import ExitCode
+from src.utils import calibration, ffmpeg_progress, loudness, profiling
+from src.utils.ffmpeg_progress import Progress, StalledError
+from src.utils.job_queue import Heartbeat, JobQueue, LEASED_DIRECTORY, Lease, PENDING_DIRECTORY
+from src.utils.ledger import Ledger, Stage, Variant
+from src.utils.metrics import metrics
+from src.utils.scratch import Scratch, partial_name, promote
+from src.utils.utils import StepError
 from src.utils.working_directory import WorkingDirectory
 
 
@@ -21,7 +31,7 @@ logger = logging.getLogger(__name__)
 
 
 def remove_previous_video(working_directory: WorkingDirectory):
-    if paths := working_directory.get_video_paths():
+    if paths := working_directory.get_video_paths() + working_directory.get_ratio_video_paths():
         for video in paths: video.unlink()
         logger.info(f'Cleared files: {", ".join([x.name for x in paths])}')
 
@@ -34,6 +44,7 @@ class Preset(Enum):
     FAST = 'fast'
     SUPER_FAST = 'superfast'
     ULTRA_FAST = 'ultrafast'
+    AUTO = 'auto'
 
     @classmethod
     @property
@@ -41,81 +52,565 @@ class Preset(Enum):
         return cls.ULTRA_FAST
 
 
-def _nightcore_to_video(
-        nightcore: Path,
-        cover: Path,
-        video: Path,
-        preset: Preset,
-        ratio: Ratio,
-) -> bool:
+class SegmentationMode(Enum):
+    AUTO = 'auto'
+    ALWAYS = 'always'
+    NEVER = 'never'
+
+    @classmethod
+    @property
+    def DEFAULT(cls) -> Self:
+        return cls.AUTO
+
+
+@dataclass
+class EncodeTask:
+    nightcore: Path
+    cover: Path
+    videos: list[Path]
+    preset: Preset
+    ratios: list[Ratio]
+    crf: int = config.DEFAULT_CRF
+    segment: Optional[int] = None
+    segment_count: Optional[int] = None
+    frames: Optional[int] = None
+    gain: Optional[float] = None
+
+    @property
+    def is_segment(self) -> bool:
+        return self.segment is not None
+
+    def to_dict(self) -> dict:
+        return asdict(self) | {
+            'nightcore': str(self.nightcore),
+            'cover': str(self.cover),
+            'videos': [str(x) for x in self.videos],
+            'preset': self.preset.value,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Self:
+        return cls(**data | {
+            'nightcore': Path(data['nightcore']),
+            'cover': Path(data['cover']),
+            'videos': [Path(x) for x in data['videos']],
+            'preset': Preset(data['preset']),
+        })
+
+
+@dataclass
+class EncodeResult:
+    started_at: float
+    finished_at: float
+    size: Optional[int] = None
+    frames: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def fps(self) -> Optional[float]:
+        return self.frames / (self.finished_at - self.started_at) if self.frames else None
+
+    @classmethod
+    def combine(cls, results: list[Self], size: Optional[int] = None) -> Self:
+        errors = [x.error for x in results if x.error]
+        return cls(
+            started_at=min(x.started_at for x in results),
+            finished_at=max(x.finished_at for x in results),
+            size=size,
+            frames=sum(x.frames or 0 for x in results),
+            error=errors[0] if errors else None,
+        )
+
+
+@dataclass
+class VariantJob:
+    variant: Variant
+    nightcore: Path
+    videos: list[Path]
+    outputs: list[Path]
+    tasks: list[EncodeTask]
+    results: dict[int, EncodeResult] = field(default_factory=dict)
+
+    @property
+    def is_segmented(self) -> bool:
+        return self.tasks[0].is_segment
+
+    @property
+    def remaining(self) -> list[int]:
+        return [i for i in range(len(self.tasks)) if i not in self.results or self.results[i].error]
+
+
+def segment_path(video: Path, segment: int, directory: Path) -> Path:
+    return directory / partial_name(video, f'{segment:03}')
+
+
+def unique_ratios(ratios: list[Ratio]) -> list[Ratio]:
+    # ratios that reduce to the same video name would be written twice, the first one stays first as the uploaded one
+    unique = {}
+    for x in ratios: unique.setdefault(WorkingDirectory.reduce_ratio(x), x)
+    return list(unique.values())
+
+
+def get_segment_count(mode: SegmentationMode, variant_count: int, duration: float) -> int:
+    match mode:
+        case SegmentationMode.NEVER:
+            return 1
+        case SegmentationMode.AUTO if variant_count >= multiprocessing.cpu_count() or duration < config.SEGMENTATION_MIN_DURATION:
+            return 1
+
+    count = max(-(-multiprocessing.cpu_count() // variant_count), 2)
+    return max(min(count, int(duration // config.SEGMENT_MIN_DURATION)), 1)
+
+
+def split_into_segments(duration: float, count: int) -> list[int]:
+    # segments are whole numbers of frames, each of them starts with a keyframe of its own encode
+    frames = math.ceil(duration * config.VIDEO_FRAME_RATE)
+    return [frames // count + (1 if i < frames % count else 0) for i in range(count)]
 
+
+def _cover_streams(cover: Path, ratios: list[Ratio]) -> list:
     with Image.open(cover) as x:
         width, height = x.size
-        speed, reverb = WorkingDirectory.path_to_speed_and_reverb(nightcore)
 
+    # the cover is decoded once and split into every ratio
+    stream = ffmpeg.input(cover, loop=1, framerate=config.VIDEO_FRAME_RATE)
+    streams = stream.filter_multi_output('split', len(ratios)) if len(ratios) > 1 else None
+    result = []
+
+    for i, ratio in enumerate(ratios):
         new_width = round(height * ratio)
         if new_width % 2 != 0: new_width += 1
 
-        def wrap_log(log: str):
-            return f'{speed:>3}x{reverb:<2}: {log}'
-
-        try:
-            (
-                ffmpeg
-                .output(
-                    ffmpeg.input(nightcore),
-                    (
-                        ffmpeg.input(cover, loop=1)
-                        .filter('scale', new_width, height, force_original_aspect_ratio='decrease')
-                        .filter('pad', new_width, height, '(iw-ow)/2', '(ih-oh)/2', color='black')
-                    ),
+        result.append(
+            (streams[i] if streams else stream)
+            .filter('scale', new_width, height, force_original_aspect_ratio='decrease')
+            .filter('pad', new_width, height, '(iw-ow)/2', '(ih-oh)/2', color='black')
+        )
+
+    return result
+
+
+def _audio_streams(nightcore: Path, gain: Optional[float], count: int = 1) -> tuple[list, dict]:
+    # applying the gain needs a re-encode, otherwise the rendered audio is copied as is
+    audio = ffmpeg.input(nightcore).audio
+
+    if gain is None:
+        return [audio] * count, {'c:a': 'copy'}
+
+    audio = audio.filter('volume', f'{gain}dB')
+    streams = audio.filter_multi_output('asplit', count) if count > 1 else None
+    return [streams[i] for i in range(count)] if streams else [audio], {'c:a': 'aac', 'b:a': config.AUDIO_BITRATE}
+
+
+def _run_logged(stream, nightcore: Path, duration: Optional[float], segment: str = '') -> EncodeResult:
+    started_at = time.time()
+    speed, reverb = WorkingDirectory.path_to_speed_and_reverb(nightcore)
+
+    def wrap_log(log: str):
+        return f'{speed:>3}x{reverb:<2}: {segment}{log}'
+
+    last_logged_at = time.monotonic()
+
+    def log_progress(progress: Progress):
+        nonlocal last_logged_at
+
+        if progress.finished or time.monotonic() - last_logged_at >= config.FFMPEG_PROGRESS_LOG_INTERVAL:
+            logger.info(wrap_log(progress.represent(duration)))
+            last_logged_at = time.monotonic()
+
+    try:
+        progress = ffmpeg_progress.run(stream, duration=duration, on_progress=log_progress)
+
+    except StalledError as e:
+        logger.warning(wrap_log(f'Killed stalled encode: {e}'))
+        return EncodeResult(started_at, time.time(), error=f'StalledError: {e}')
+
+    except ffmpeg.Error as e:
+        logger.info(wrap_log(f'Most likely caught keyboard interruption: {e.stderr.decode().strip() if e.stderr else e}'))
+        return EncodeResult(started_at, time.time(), error=f'ffmpeg: {e}')
+
+    return EncodeResult(started_at, time.time(), frames=progress.frame)
+
+
+def _nightcore_to_video(task: EncodeTask) -> EncodeResult:
+    started_at = time.time()
+
+    try:
+        cover_streams = _cover_streams(task.cover, task.ratios)
+
+        if task.is_segment:
+            duration = task.frames / config.VIDEO_FRAME_RATE
+            stream = ffmpeg.merge_outputs(*[
+                ffmpeg.output(
+                    cover_stream,
+                    str(video),
+                    vcodec='libx264',
+                    crf=task.crf,
+                    preset=task.preset.value,
+                    an=None,
+                    **{'frames:v': task.frames},
+                )
+                for cover_stream, video in zip(cover_streams, task.videos)
+            ])
+            result = _run_logged(stream, task.nightcore, duration, segment=f'[{task.segment + 1}/{task.segment_count}] ')
+
+        else:
+            duration = ffmpeg_progress.probe_duration(task.nightcore)
+            audio_streams, audio_codec = _audio_streams(task.nightcore, task.gain, len(task.videos))
+            stream = ffmpeg.merge_outputs(*[
+                ffmpeg.output(
+                    audio,
+                    cover_stream,
                     str(video),
                     vcodec='libx264',
-                    crf=18,
-                    preset=preset.value,
+                    crf=task.crf,
+                    preset=task.preset.value,
                     shortest=None,
-                    acodec='aac',
-                    **{'c:a': 'copy'},
+                    **audio_codec,
                 )
-                .global_args('-loglevel', 'quiet')
-                .run(overwrite_output=True)
+                for audio, cover_stream, video in zip(audio_streams, cover_streams, task.videos)
+            ])
+            result = _run_logged(stream, task.nightcore, duration)
+
+    except Exception as e:
+        traceback.print_exc()
+        return EncodeResult(started_at, time.time(), error=f'{type(e).__name__}: {e}')
+
+    if result.error is None: result.size = sum(x.stat().st_size for x in task.videos)
+    return result
+
+
+def _quote_concat_path(path: Path) -> str:
+    return "'" + str(path).replace("'", "'\\''") + "'"
+
+
+def _concat_segments(nightcore: Path, segments: list[Path], video: Path, gain: Optional[float]) -> EncodeResult:
+    started_at = time.time()
+    segment_list = video.with_name(f'.{video.stem}.segments.txt')
+
+    try:
+        segment_list.write_text(''.join(f'file {_quote_concat_path(x)}\n' for x in segments))
+        (audio,), audio_codec = _audio_streams(nightcore, gain)
+        stream = ffmpeg.output(
+            ffmpeg.input(str(segment_list), f='concat', safe=0)['v'],
+            audio,
+            str(video),
+            vcodec='copy',
+            shortest=None,
+            **audio_codec,
+        )
+        result = _run_logged(stream, nightcore, ffmpeg_progress.probe_duration(nightcore), segment='[concat] ')
+
+    except Exception as e:
+        traceback.print_exc()
+        return EncodeResult(started_at, time.time(), error=f'{type(e).__name__}: {e}')
+
+    finally:
+        segment_list.unlink(missing_ok=True)
+
+    if result.error is None:
+        result.size = video.stat().st_size
+        result.frames = 0  # frames were counted by the segment encodes
+
+    return result
+
+
+def _measure_ssim(video: Path, cover: Path, ratio: Ratio) -> float:
+    # the cover is still, so the encode is compared with the same frame it was made from,
+    # cropped to the cover because the identical black padding would hide the loss
+    with Image.open(cover) as x:
+        width, height = x.size
+
+    width = min(width, round(height * ratio))
+    streams = [ffmpeg.input(str(video)), _cover_streams(cover, [ratio])[0]]
+    _, log = (
+        ffmpeg
+        .filter([x.filter('crop', width, height) for x in streams], 'ssim', shortest=1)
+        .output('-', f='null')
+        .global_args('-hide_banner', '-nostats')
+        .run(capture_stderr=True)
+    )
+    return float(re.findall(r'All:([\d.]+)', log.decode())[-1])
+
+
+def _measure_encode(cover: Path, ratios: list[Ratio], preset: str, crf: int) -> tuple[float, list[int], float]:
+    with tempfile.TemporaryDirectory(prefix='nightcore-calibration-') as directory:
+        videos = [Path(directory) / f'{i}.mp4' for i in range(len(ratios))]
+        stream = ffmpeg.merge_outputs(*[
+            ffmpeg.output(
+                cover_stream,
+                str(video),
+                vcodec='libx264',
+                crf=crf,
+                preset=preset,
+                an=None,
+                **{'frames:v': config.CALIBRATION_DURATION * config.VIDEO_FRAME_RATE},
             )
+            for cover_stream, video in zip(_cover_streams(cover, ratios), videos)
+        ])
+
+        started_at = time.perf_counter()
+        stream.global_args('-loglevel', 'error').run(overwrite_output=True)
+        seconds = time.perf_counter() - started_at
+
+        # quality of the uploaded ratio
+        return seconds, [x.stat().st_size for x in videos], _measure_ssim(videos[0], cover, ratios[0])
+
+
+def select_preset(
+        cover: Path,
+        ratios: list[Ratio],
+        durations: list[float],
+        ledger: Ledger,
+        calibration_path: Path = config.CALIBRATION_CACHE_PATH,
+        uplink: Optional[float] = None,
+) -> tuple[Preset, int]:
+    calibrations = calibration.calibrate(cover, ratios, lambda preset, crf: _measure_encode(cover, ratios, preset, crf), path=calibration_path)
+    measured_uplink = ledger.throughput(Stage.UPLOAD, since=time.time() - config.UPLINK_HISTORY_DAYS * 24 * 60 * 60)
+    selected = calibration.select(calibrations, video_seconds=sum(durations), uploaded_seconds=sum(durations), uplink=uplink or measured_uplink)
+
+    if uplink:
+        uplink_log = f'{uplink / 2 ** 20:.2f}MB/s given'
+    elif measured_uplink:
+        uplink_log = f'{measured_uplink / 2 ** 20:.2f}MB/s measured'
+    else:
+        uplink_log = f'{config.DEFAULT_UPLINK / 2 ** 20:.2f}MB/s assumed'
+
+    logger.info(f'Selected preset: {selected.preset}, CRF {selected.crf}, SSIM {selected.ssim:.4f} (uplink {uplink_log})')
+    return Preset(selected.preset), selected.crf
+
+
+def _profiled(profile_directory: Optional[Path], function, *args) -> EncodeResult:
+    with profiling.profile(profile_directory, 'nightcore_to_video'):
+        return function(*args)
+
+
+def _encode_leased(queue: JobQueue, lease: Lease, worker: str, scratch_directory: Optional[Path] = None) -> EncodeResult:
+    # another worker may take over an expired lease, so videos are written under worker names and promoted only by the holder
+    task = EncodeTask.from_dict(lease.payload)
+    temporary_videos = [(scratch_directory or x.parent) / partial_name(x, worker) for x in task.videos]
+
+    with Heartbeat(queue, lease) as heartbeat:
+        result = _nightcore_to_video(replace(task, videos=temporary_videos))
+
+    if heartbeat.is_held and result.error is None:
+        for temporary_video, video in zip(temporary_videos, task.videos): promote(temporary_video, video)
+    else:
+        for x in temporary_videos: x.unlink(missing_ok=True)
+
+    return result
+
+
+def work(queue: JobQueue, worker: str, idle_timeout: Optional[float] = None, scratch_directory: Optional[Path] = None):
+    idle_since = time.monotonic()
+
+    while idle_timeout is None or time.monotonic() - idle_since < idle_timeout:
+        if reaped := queue.reap():
+            logger.warning(f'Reassigning {len(reaped)} job(s) of lost workers')
+
+        if not (lease := queue.claim(worker)):
+            time.sleep(config.JOB_POLL_INTERVAL)
+            continue
+
+        logger.info(f'{worker}: Claimed job {lease.job_id}')
+        result = _encode_leased(queue, lease, worker, scratch_directory)
+
+        if not queue.complete(lease, asdict(result)):
+            logger.warning(f'{worker}: Lost the lease of job {lease.job_id}, discarded its videos')
 
-        except ffmpeg.Error as e:
-            logger.info(wrap_log(f'Most likely caught keyboard interruption: {e}'))
-            return False
+        idle_since = time.monotonic()
 
-        except Exception:
-            traceback.print_exc()
-            return False
 
-    return True
+def _encode_queued(queue: JobQueue, tasks: list[EncodeTask], positions: dict[int, int]) -> list[EncodeResult]:
+    # retried tasks keep the queue position of their first submission instead of waiting behind jobs of other pipelines
+    job_ids = [queue.submit(x.to_dict(), position=positions.setdefault(id(x), time.time_ns())) for x in tasks]
+    results = {}
+    logged = None
+    active_at = time.monotonic()
+
+    try:
+        while len(results) < len(job_ids):
+            if reaped := queue.reap():
+                logger.warning(f'Reassigning {len(reaped)} job(s) of lost workers')
+
+            for job_id in job_ids:
+                if job_id not in results and (result := queue.result(job_id)) is not None:
+                    results[job_id] = EncodeResult(**result)
+                    active_at = time.monotonic()
+
+            # any held lease means a live worker, possibly busy with jobs of other pipelines, expired ones were reaped above
+            remaining = [x for x in job_ids if x not in results]
+            if queue.leased(): active_at = time.monotonic()
+
+            if time.monotonic() - active_at > config.JOB_QUEUE_TIMEOUT:
+                logger.error(f'No worker has been running any job of the queue for {config.JOB_QUEUE_TIMEOUT}s, is any worker started?')
+                queue.cancel(remaining)
+                now = time.time()
+                results |= {x: EncodeResult(now, now, error='No worker took the job') for x in remaining}
+                break
+
+            if (state := (len(results), queue.count(PENDING_DIRECTORY), queue.count(LEASED_DIRECTORY))) != logged:
+                logger.info(f'Encode jobs: {state[0]}/{len(job_ids)} done, {state[1]} pending, {state[2]} running in the queue')
+                logged = state
+
+            time.sleep(config.JOB_POLL_INTERVAL)
+
+    finally:
+        queue.cancel([x for x in job_ids if x not in results])
+
+        # left by lost workers
+        for video in [x for task in tasks for x in task.videos]:
+            for x in video.parent.glob(partial_name(video, '*')): x.unlink(missing_ok=True)
+
+    return [results[x] for x in job_ids]
 
 
 def nightcore_to_video(
         working_directory: WorkingDirectory,
+        ledger: Ledger,
         preset: Preset = Preset.DEFAULT,
-        ratio: Ratio = config.MIN_VIDEO_RATIO,
+        ratios: Optional[list[Ratio]] = None,
+        segmentation: SegmentationMode = SegmentationMode.DEFAULT,
+        profile_directory: Optional[Path] = None,
+        queue_directory: Optional[Path] = None,
+        scratch: Optional[Scratch] = None,
+        normalize: bool = False,
+        calibration_path: Path = config.CALIBRATION_CACHE_PATH,
+        uplink: Optional[float] = None,
 ):
     # preparation
     remove_previous_video(working_directory)
+    ratios = unique_ratios(ratios or [config.MIN_VIDEO_RATIO])
+    scratch = scratch or Scratch(working_directory.get_path())
 
     nightcores = working_directory.get_nightcore_paths(raise_if_not_exist=True)
     cover = working_directory.get_cover_path()
-    videos = [x.with_suffix('.mp4') for x in nightcores]
+    track_name = working_directory.get_track_name()
+    durations = [ffmpeg_progress.probe_duration(x) for x in nightcores]
+    crf = config.DEFAULT_CRF
+    jobs = []
+
+    if preset is Preset.AUTO:
+        preset, crf = select_preset(cover, ratios, durations, ledger, calibration_path=calibration_path, uplink=uplink)
+
+    gains = {x: None for x in nightcores}
+
+    # the source is analysed once, variants get a gain predicted from their speed and reverb
+    if normalize:
+        track_loudness = loudness.analyze(working_directory.get_track_path(raise_if_not_exists=True), working_directory.get_loudness_cache_path())
+        gains = {x: track_loudness.gain(*WorkingDirectory.path_to_speed_and_reverb(x)) for x in nightcores}
+        logger.info(f'Loudness: {track_loudness.represent()}, gains: {", ".join(f"{x.stem} {y:+.1f}dB" for x, y in gains.items())}')
+
+    for nightcore, duration in zip(nightcores, durations):
+        video = nightcore.with_suffix('.mp4')
+        videos = [video] + [WorkingDirectory.video_path_with_ratio(video, x) for x in ratios[1:]]
+        variant = Variant(track_name, *WorkingDirectory.path_to_speed_and_reverb(nightcore))
+        segment_count = get_segment_count(segmentation, len(nightcores), duration)
+        outputs = [scratch.path_for(x) for x in videos]
+        # remote workers can't see the local scratch, they promote their encodes into the working directory themselves
+        encode_directory = working_directory.get_path() if queue_directory else scratch.path
+
+        if segment_count == 1:
+            outputs = videos if queue_directory else outputs
+            tasks = [EncodeTask(nightcore, cover, outputs, preset, ratios, crf=crf, gain=gains[nightcore])]
+        else:
+            tasks = [
+                EncodeTask(
+                    nightcore,
+                    cover,
+                    [segment_path(x, i, encode_directory) for x in videos],
+                    preset,
+                    ratios,
+                    crf=crf,
+                    segment=i,
+                    segment_count=segment_count,
+                    frames=frames,
+                    gain=gains[nightcore],
+                )
+                for i, frames in enumerate(split_into_segments(duration, segment_count))
+            ]
+
+        jobs.append(VariantJob(variant, nightcore, videos, outputs, tasks))
 
     # conversion
-    logger.info('Creating videos concurrently')
-    N = len(nightcores)
-    args = zip(
-        nightcores,
-        [cover] * len(nightcores),
-        videos,
-        [preset] * N,
-        [ratio] * N,
+    task_count = sum(len(x.tasks) for x in jobs)
+    logger.info(
+        f'Creating videos {f"on the workers of `{queue_directory}`" if queue_directory else "concurrently"}'
+        f'{f" in {task_count} segments" if task_count > len(jobs) else ""}'
     )
-    processes = min(multiprocessing.cpu_count(), len(nightcores))
+    queue = JobQueue(queue_directory) if queue_directory else None
+    queue_positions = {}
+    processes = min(multiprocessing.cpu_count(), task_count)
+    pending = jobs
+    failed = []
 
     with multiprocessing.Pool(processes=processes) as pool:
-        if not(all(pool.starmap(_nightcore_to_video, args))):
-            sys.exit(ExitCode.GENERAL_ERROR)
+        while pending:
+            retried = []
+            tasks = [(job, i) for job in pending for i in job.remaining]
+
+            if queue:
+                results = _encode_queued(queue, [job.tasks[i] for job, i in tasks], queue_positions)
+            else:
+                results = pool.starmap(_profiled, [(profile_directory, _nightcore_to_video, job.tasks[i]) for job, i in tasks])
+
+            for (job, i), result in zip(tasks, results):
+                job.results[i] = result
+
+            # segments of a variant are joined only once all of them are encoded, each ratio separately
+            concatenated = [x for x in pending if x.is_segmented and not x.remaining]
+            concats = [(job, i) for job in concatenated for i in range(len(job.videos))]
+            concat_results = pool.starmap(
+                _profiled,
+                [
+                    (profile_directory, _concat_segments, job.nightcore, [x.videos[i] for x in job.tasks], job.outputs[i], job.tasks[0].gain)
+                    for job, i in concats
+                ],
+            )
+
+            for job in pending:
+                results = [job.results[i] for i in sorted(job.results)]
+                results += [x for (y, _), x in zip(concats, concat_results) if y is job]
+                result = EncodeResult.combine(results)
+
+                if result.error is None:
+                    if job.is_segmented:
+                        for x in job.tasks:
+                            for y in x.videos: scratch.discard(y)
+
+                    for output, video in zip(job.outputs, job.videos):
+                        if output != video: scratch.promote(output, video)
+
+                    result.size = sum(x.stat().st_size for x in job.videos)
+
+                ledger.record(job.variant, Stage.ENCODE, result.started_at, result.finished_at, size=result.size, error=result.error)
+                metrics.record(
+                    Stage.ENCODE.value,
+                    result.started_at,
+                    result.finished_at,
+                    variant=job.variant,
+                    failed=result.error is not None,
+                    values={'bytes': result.size, 'fps': result.fps, 'segments': len(job.tasks), 'gain_db': job.tasks[0].gain},
+                )
+
+                if result.error is None:
+                    continue
+
+                # outputs of the failed attempt never reach the working directory, count them as scratch writes
+                for i in range(len(job.tasks)) if job in concatenated else [x for x in job.results if job.results[x].error]:
+                    for x in job.tasks[i].videos: scratch.discard(x)
+
+                for output, video in zip(job.outputs, job.videos):
+                    if output != video: scratch.discard(output)
+
+                if ledger.can_retry(job.variant, Stage.ENCODE):
+                    logger.warning(f'{job.variant.represent()}: Encoding failed, retrying: {result.error}')
+                    if job in concatenated: job.results.clear()
+                    retried.append(job)
+                else:
+                    failed.append(job.variant)
+
+            pending = retried
+
+    if failed:
+        raise StepError(f'Encoding failed after {ledger.max_attempts} attempts: {", ".join(x.represent().strip() for x in failed)}')
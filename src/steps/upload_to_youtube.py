@@ -1,7 +1,6 @@
 import logging
 import pickle
 import re
-import sys
 import time
 from pathlib import Path
 from typing import Optional
@@ -13,8 +12,11 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 
 from src import config
+from src.utils.ledger import Ledger, Stage, Variant
 from src.utils.metadata import Metadata
-from src.utils.utils import ExitCode
+from src.utils.metrics import metrics
+from src.utils.upload_queue import Quota, QueuedUpload, UploadQueue
+from src.utils.utils import StepError
 from src.utils.working_directory import WorkingDirectory
 
 
@@ -73,15 +75,26 @@ def generate_speed_names(amount_slowed, amount_sped_up):
         case 3: sped_up = [0, 1, 2]
         case _: raise ValueError(f'Unexpected amount of sped up versions: {amount_slowed}')
 
-    return [config.SLOWED_NAMES[x] for x in slowed] + [config.SPED_UP_NAMES[x] for x in sped_up]
+    return [SLOWED_NAMES[x] for x in slowed] + [SPED_UP_NAMES[x] for x in sped_up]
 
 
 def parse_to_hashtags(string: str) -> list[str]:
     return re.sub(r'[^a-zA-Z0-9\s]', '', string).split()
 
 
-def wait_for_uploading_to_finish(service, id, check_interval=1):
+class ProcessingError(Exception):
+    def __init__(self, video_id: str):
+        super().__init__(f'Processing of video {video_id} failed')
+        self.video_id = video_id
+
+
+def wait_for_uploading_to_finish(service, id, quota: Quota, check_interval=config.PROCESSING_CHECK_INTERVAL):
     while True:
+        if not quota.can_spend(config.QUOTA_COSTS['videos.list']):
+            logger.warning('Not enough quota left to check processing status, the video is uploaded anyway')
+            return
+
+        quota.spend(config.QUOTA_COSTS['videos.list'])
         response = service.videos().list(part='processingDetails', id=id).execute()
         status = response['items'][0]['processingDetails']['processingStatus']
 
@@ -89,14 +102,16 @@ def wait_for_uploading_to_finish(service, id, check_interval=1):
             case 'succeeded':
                 return
             case 'failed':
-                logger.error(f'Processing failed')
-                sys.exit(ExitCode.GENERAL_ERROR)
+                raise ProcessingError(id)
 
         time.sleep(check_interval)
 
 
 def upload_video(
         service,
+        ledger: Ledger,
+        quota: Quota,
+        variant: Variant,
         path: Path,
         artist: str,
         name: str,
@@ -104,7 +119,7 @@ def upload_video(
         speed_name_max_length: str,
         is_sped_up: bool,
         metadata: Metadata,
-) -> bool:
+) -> Optional[str]:
 
     # setting up YouTube metadata
     title = f'{artist} - {name} ({speed_name})'
@@ -138,19 +153,92 @@ def upload_video(
     media = MediaFileUpload(path, mimetype='video/*', resumable=True)
     request = service.videos().insert(part=','.join(body), body=body, media_body=media)
     response = None
+    quota.spend(config.QUOTA_COSTS['videos.insert'])
+
+    with ledger.attempt(variant, Stage.UPLOAD) as attempt, metrics.span(Stage.UPLOAD.value, variant) as span:
+        while response is None:
+            try:
+                status, response = request.next_chunk()
+            except errors.ResumableUploadError as e:
+                logger.warning(f'Daily upload limit exceeded. Carrying over the remaining uploads')
+                ledger.fail(attempt, f'ResumableUploadError: {e}')
+                span.labels['status'] = 'failed'
+                quota.exhaust()
+                return None
+
+        attempt.size = span.values['bytes'] = path.stat().st_size
+        span.values['bytes_per_second'] = attempt.size / max(time.time() - span.started_at, 1e-3)
+
+    with ledger.attempt(variant, Stage.PROCESSING), metrics.span(Stage.PROCESSING.value, variant):
+        wait_for_uploading_to_finish(service, response['id'], quota)
 
-    while response is None:
-        try:
-            status, response = request.next_chunk()
-        except errors.ResumableUploadError:
-            logger.warning(f'Daily upload limit exceeded. Cancelling uploads')
+    return response['id']
+
+
+def upload_cost(uploads: list[QueuedUpload]) -> int:
+    return len(uploads) * (config.QUOTA_COSTS['videos.insert'] + config.PROCESSING_QUOTA_RESERVE)
+
+
+def upload_queued(service, ledger: Ledger, queue: UploadQueue, failed: list[str]) -> bool:
+    # returns whether the queue was drained, videos that failed processing are collected into `failed`
+    for uploads in queue.pending():
+        # a speed set is started only if all of it fits into today's quota, unless it never fits or was already started
+        fits = queue.quota.can_spend(upload_cost(uploads))
+        never_fits = upload_cost(uploads) > queue.quota.limit and queue.quota.used() == 0
+
+        if not (fits or never_fits or queue.is_started(uploads[0])):
             return False
 
-    wait_for_uploading_to_finish(service, response['id'])
+        speed_name_max_length = max([len(x.speed_name) for x in uploads])
+
+        for upload in uploads:
+            if not queue.quota.can_spend(upload_cost([upload])):
+                return False
+
+            if not upload.path.exists():
+                logger.warning(f'Skipping missing video: {upload.path}')
+                queue.mark_failed(upload, 'Missing video')
+                continue
+
+            artist, name = tuple(upload.track.split(' - ', 1))
+
+            try:
+                video_id = upload_video(
+                    service,
+                    ledger,
+                    queue.quota,
+                    variant=Variant(upload.track, upload.speed, upload.reverb),
+                    path=upload.path,
+                    artist=artist,
+                    name=name,
+                    speed_name=upload.speed_name,
+                    speed_name_max_length=speed_name_max_length,
+                    is_sped_up=upload.is_sped_up,
+                    metadata=Metadata.from_string(upload.metadata),
+                )
+            except ProcessingError as e:
+                # the video is on YouTube already, so it must never be uploaded again by a later run
+                logger.error(f"'{upload.speed_name}': {e}")
+                queue.mark_failed(upload, str(e), video_id=e.video_id)
+                failed.append(f"'{upload.track}' ({upload.speed_name}): {e}")
+                continue
+
+            if not video_id:
+                return False
+
+            queue.mark_uploaded(upload, video_id)
+
     return True
 
 
-def upload_to_youtube(working_directory: WorkingDirectory, uploaded_video_count: Optional[int]):
+def upload_to_youtube(
+        working_directory: WorkingDirectory,
+        ledger: Ledger,
+        uploaded_video_count: Optional[int],
+        wait_for_quota: bool = False,
+        daily_quota: int = config.YOUTUBE_DAILY_QUOTA,
+        service=None,
+):
     # sort videos by speed
     videos = working_directory.get_video_paths(raise_if_not_exist=True)
     speeds = [working_directory.path_to_speed_and_reverb(x)[0] for x in videos]
@@ -162,20 +250,49 @@ def upload_to_youtube(working_directory: WorkingDirectory, uploaded_video_count:
     videos_and_parameters = list(zip(*zip(*sorted_videos_and_speeds), sorted_speed_names))
     if uploaded_video_count: videos_and_parameters = videos_and_parameters[:uploaded_video_count] if uploaded_video_count > 0 else videos_and_parameters[uploaded_video_count:]
 
-    # upload videos
-    service = build('youtube', 'v3', credentials=get_credentials())
-    track_name = working_directory.get_track_path(raise_if_not_exists=True).stem
-
-    for video, speed, speed_name in videos_and_parameters:
-        artist, name = tuple(track_name.split(' - ', 1))
-        if not upload_video(
-            service,
+    # queue videos after the ones carried over from previous runs
+    queue = UploadQueue(ledger.path, daily_quota=daily_quota)
+    track_name = working_directory.get_track_name()
+    is_queued = queue.enqueue(working_directory.get_path(), [
+        QueuedUpload(
+            id=None,
+            directory=working_directory.get_path(),
+            track=track_name,
             path=video,
-            artist=artist,
-            name=name,
+            speed=speed,
+            reverb=working_directory.path_to_speed_and_reverb(video)[1],
             speed_name=speed_name,
-            speed_name_max_length=max([len(x) for _, _, x in videos_and_parameters]),
             is_sped_up=speed > config.STANDARD_SPEED,
-            metadata=working_directory.get_metadata(),
-        ):
-            return
+            metadata=working_directory.get_cover_path(raise_if_not_exists=True).stem,
+            position=i,
+        )
+        for i, (video, speed, speed_name) in enumerate(videos_and_parameters)
+    ])
+
+    if not is_queued:
+        logger.info('Resuming the speed set carried over from a previous run')
+
+    if carried_over := sum(len(x) for x in queue.pending() if x[0].directory != working_directory.get_path()):
+        logger.info(f'Uploading {carried_over} videos carried over from previous runs first')
+
+    # upload videos
+    service = service or build('youtube', 'v3', credentials=get_credentials())
+
+    failed = []
+
+    try:
+        while not upload_queued(service, ledger, queue, failed):
+            remaining = sum(len(x) for x in queue.pending())
+            reset = queue.quota.next_reset()
+
+            if not wait_for_quota:
+                logger.warning(f'Quota is used up, {remaining} videos are carried over until {reset:%Y-%m-%d %H:%M %Z}')
+                break
+
+            logger.info(f'Quota is used up, waiting until {reset:%Y-%m-%d %H:%M %Z} to upload {remaining} videos')
+            time.sleep(queue.quota.seconds_until_reset() + config.QUOTA_RESET_MARGIN)
+    finally:
+        queue.close()
+
+    if failed:
+        raise StepError(f'Processing failed: {", ".join(failed)}')
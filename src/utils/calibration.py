@@ -0,0 +1,92 @@
+import json
+import logging
+import platform
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from PIL import Image, ImageFilter
+
+from src import config
+
+
+logger = logging.getLogger(__name__)
+
+
+Measure = Callable[[str, int], tuple[float, list[int], float]]
+
+
+@dataclass
+class Calibration:
+    preset: str
+    crf: int
+    seconds_per_second: float
+    bytes_per_second: list[float]
+    ssim: float
+
+    def estimate(self, video_seconds: float, uploaded_seconds: float, uplink: float) -> float:
+        # encode time of every ratio plus upload time of the first (uploaded) one
+        return self.seconds_per_second * video_seconds + self.bytes_per_second[0] * uploaded_seconds / uplink
+
+
+def cache_key(cover: Path, ratios: list[float]) -> str:
+    # encode speed, size and quality depend on the resolution and the amount of detail of the cover rather than on the exact image,
+    # so covers of one class share a calibration instead of every new track running the whole grid again
+    with Image.open(cover) as image:
+        width, height = image.size
+        detail = image.convert('L').filter(ImageFilter.FIND_EDGES).entropy()
+
+    detail = round(detail / config.CALIBRATION_DETAIL_STEP) * config.CALIBRATION_DETAIL_STEP
+    return f'{width}x{height}:{detail:.1f}:{",".join(f"{x:.4f}" for x in ratios)}'
+
+
+def load_cache(path: Path = config.CALIBRATION_CACHE_PATH) -> dict:
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def calibrate(
+        cover: Path,
+        ratios: list[float],
+        measure: Measure,
+        path: Path = config.CALIBRATION_CACHE_PATH,
+) -> list[Calibration]:
+    cache = load_cache(path)
+    host_cache = cache.setdefault(platform.node(), {})
+    key = cache_key(cover, ratios)
+
+    if key in host_cache:
+        return [Calibration(**x) for x in host_cache[key]]
+
+    logger.info(f'Calibrating presets on {config.CALIBRATION_DURATION}s of the cover')
+    started_at = time.perf_counter()
+    calibrations = []
+
+    for preset in config.AUTO_PRESETS:
+        for crf in config.AUTO_CRFS:
+            seconds, sizes, ssim = measure(preset, crf)
+            calibrations.append(Calibration(
+                preset=preset,
+                crf=crf,
+                seconds_per_second=seconds / config.CALIBRATION_DURATION,
+                bytes_per_second=[x / config.CALIBRATION_DURATION for x in sizes],
+                ssim=ssim,
+            ))
+
+    logger.info(f'Calibrated in {time.perf_counter() - started_at:.0f}s, cached for covers of the same class ({key.rpartition(":")[0]})')
+    host_cache[key] = [asdict(x) for x in calibrations]
+    path.write_text(json.dumps(cache, indent=2) + '\n')
+    return calibrations
+
+
+def select(
+        calibrations: list[Calibration],
+        video_seconds: float,
+        uploaded_seconds: float,
+        uplink: Optional[float],
+        min_ssim: float = config.AUTO_MIN_SSIM,
+) -> Calibration:
+    uplink = uplink or config.DEFAULT_UPLINK
+    # the quality floor, a cover that no candidate encodes well enough gets the best quality
+    candidates = [x for x in calibrations if x.ssim >= min_ssim] or [max(calibrations, key=lambda x: x.ssim)]
+    return min(candidates, key=lambda x: x.estimate(video_seconds, uploaded_seconds, uplink))
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import ffmpeg
+
+from src import config
+
+
+class StalledError(Exception):
+    ...
+
+
+@dataclass
+class Progress:
+    frame: int = 0
+    fps: float = 0
+    out_time: float = 0
+    speed: float = 0
+    total_size: int = 0
+    finished: bool = False
+
+    def eta(self, duration: Optional[float]) -> Optional[float]:
+        if not duration or not self.speed:
+            return None
+
+        return max(duration - self.out_time, 0) / self.speed
+
+    def represent(self, duration: Optional[float]):
+        eta = self.eta(duration)
+        done = f'{self.out_time:.0f}/{duration:.0f}s' if duration else f'{self.out_time:.0f}s'
+        return f'{done} fps={self.fps:.0f} speed={self.speed:.1f}x ETA={f"{eta:.0f}s" if eta is not None else "?"}'
+
+    def update(self, key: str, value: str):
+        match key:
+            case 'frame':
+                self.frame = int(value)
+            case 'fps':
+                self.fps = float(value)
+            case 'out_time_us' if value.isdigit():
+                self.out_time = int(value) / 1_000_000
+            case 'speed' if value.rstrip('x').replace('.', '', 1).isdigit():
+                self.speed = float(value.rstrip('x'))
+            case 'total_size' if value.isdigit():
+                self.total_size = int(value)
+            case 'progress':
+                self.finished = value == 'end'
+
+
+async def run_with_progress(
+        stream,
+        duration: Optional[float] = None,
+        on_progress: Optional[Callable[[Progress], None]] = None,
+        stall_timeout: float = config.FFMPEG_STALL_TIMEOUT,
+) -> Progress:
+    args = (
+        stream
+        .global_args('-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
+        .compile(overwrite_output=True)
+    )
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stderr = asyncio.create_task(process.stderr.read())
+
+    progress = Progress()
+    last_advance = time.monotonic()
+
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(process.stdout.readline(), timeout=stall_timeout)
+            except asyncio.TimeoutError:
+                line = None
+
+            if not progress.finished and time.monotonic() - last_advance > stall_timeout:
+                raise StalledError(f'No progress for {stall_timeout:.0f}s at {progress.out_time:.1f}s')
+
+            if line == b'':
+                break
+            elif not line:
+                continue
+
+            key, _, value = line.decode().strip().partition('=')
+            out_time = progress.out_time
+            progress.update(key, value)
+
+            if progress.out_time > out_time:
+                last_advance = time.monotonic()
+
+            # each block of key-value pairs ends with the `progress` key
+            if key == 'progress' and on_progress:
+                on_progress(progress)
+
+    except BaseException:
+        process.kill()
+        await process.wait()
+        raise
+
+    if await process.wait() != 0:
+        raise ffmpeg.Error('ffmpeg', None, await stderr)
+
+    return progress
+
+
+def run(stream, **kwargs) -> Progress:
+    return asyncio.run(run_with_progress(stream, **kwargs))
+
+
+def probe_duration(path) -> float:
+    return float(ffmpeg.probe(path)['format']['duration'])
@@ -0,0 +1,158 @@
+import json
+import os
+import platform
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from src import config
+
+
+PENDING_DIRECTORY = 'pending'
+LEASED_DIRECTORY = 'leased'
+DONE_DIRECTORY = 'done'
+JOB_EXTENSION = 'json'
+
+
+def worker_id() -> str:
+    # dots separate parts of lease names
+    return f'{platform.node().replace(".", "-")}-{os.getpid()}'
+
+
+def _write_atomically(path: Path, data: dict):
+    temporary_path = path.with_name(f'.{path.name}.{uuid.uuid4().hex}')
+    temporary_path.write_text(json.dumps(data))
+    temporary_path.rename(path)
+
+
+@dataclass
+class Lease:
+    job_id: str
+    path: Path
+    payload: dict
+
+
+class JobQueue:
+    # a directory on a file system shared by all hosts: jobs move between subdirectories by atomic renames,
+    # a lease is a job file in `leased/` named after its worker, its modification time is the heartbeat
+    def __init__(self, path: Path, lease_timeout: float = config.JOB_LEASE_TIMEOUT):
+        self.path = path
+        self.lease_timeout = lease_timeout
+
+        for x in [PENDING_DIRECTORY, LEASED_DIRECTORY, DONE_DIRECTORY]:
+            (self.path / x).mkdir(parents=True, exist_ok=True)
+
+    def submit(self, payload: dict, position: Optional[int] = None) -> str:
+        # ids sort in the order of submission, so older jobs are claimed first, a resubmitted job may keep its earlier position
+        job_id = f'{position or time.time_ns()}-{uuid.uuid4().hex[:8]}'
+        _write_atomically(self._pending_path(job_id), payload)
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Lease]:
+        for path in sorted((self.path / PENDING_DIRECTORY).glob(f'*.{JOB_EXTENSION}')):
+            job_id = path.name.split('.')[0]
+            leased_path = self.path / LEASED_DIRECTORY / f'{job_id}.{worker}.{JOB_EXTENSION}'
+
+            try:
+                path.rename(leased_path)
+                # renaming keeps the modification time of the submission, which may already look expired
+                os.utime(leased_path)
+                return Lease(job_id, leased_path, json.loads(leased_path.read_text()))
+            except FileNotFoundError:
+                continue  # claimed by another worker
+
+        return None
+
+    def heartbeat(self, lease: Lease) -> bool:
+        # returns whether the lease is still held
+        try:
+            os.utime(lease.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, lease: Lease, result: dict) -> bool:
+        if not lease.path.exists():
+            return False
+
+        _write_atomically(self._done_path(lease.job_id), result)
+        lease.path.unlink(missing_ok=True)
+        return True
+
+    def reap(self) -> list[str]:
+        # returns expired leases to pending, so jobs of lost workers are reassigned
+        reaped = []
+
+        for path in (self.path / LEASED_DIRECTORY).glob(f'*.{JOB_EXTENSION}'):
+            try:
+                if time.time() - path.stat().st_mtime <= self.lease_timeout:
+                    continue
+
+                job_id = path.name.split('.')[0]
+                path.rename(self._pending_path(job_id))
+                reaped.append(job_id)
+
+            except FileNotFoundError:
+                continue  # completed or reaped meanwhile
+
+        return reaped
+
+    def result(self, job_id: str) -> Optional[dict]:
+        try:
+            path = self._done_path(job_id)
+            result = json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+
+        path.unlink()
+        return result
+
+    def cancel(self, job_ids: list[str]):
+        for job_id in job_ids:
+            self._pending_path(job_id).unlink(missing_ok=True)
+            self._done_path(job_id).unlink(missing_ok=True)
+
+            # workers notice the lost lease and discard their output
+            for path in (self.path / LEASED_DIRECTORY).glob(f'{job_id}.*.{JOB_EXTENSION}'):
+                path.unlink(missing_ok=True)
+
+    def leased(self) -> set[str]:
+        return {x.name.split('.')[0] for x in (self.path / LEASED_DIRECTORY).glob(f'*.{JOB_EXTENSION}')}
+
+    def count(self, directory: str) -> int:
+        return sum(1 for _ in (self.path / directory).glob(f'*.{JOB_EXTENSION}'))
+
+    def _pending_path(self, job_id: str) -> Path:
+        return self.path / PENDING_DIRECTORY / f'{job_id}.{JOB_EXTENSION}'
+
+    def _done_path(self, job_id: str) -> Path:
+        return self.path / DONE_DIRECTORY / f'{job_id}.{JOB_EXTENSION}'
+
+
+class Heartbeat:
+    # keeps a lease alive from a background thread while the job runs, a few missed beats don't lose it
+    def __init__(self, queue: JobQueue, lease: Lease):
+        self.queue = queue
+        self.lease = lease
+        self.interval = queue.lease_timeout / config.JOB_HEARTBEATS_PER_LEASE
+        self.is_held = True
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+        self.is_held = self.is_held and self.queue.heartbeat(self.lease)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if not self.queue.heartbeat(self.lease):
+                self.is_held = False
+                return
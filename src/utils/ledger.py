@@ -0,0 +1,212 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Iterator, Optional
+
+from src import config
+
+
+class Stage(Enum):
+    RENDER = 'render'
+    ENCODE = 'encode'
+    UPLOAD = 'upload'
+    PROCESSING = 'processing'
+
+
+class Status(Enum):
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+
+@dataclass(frozen=True)
+class Variant:
+    track: str
+    speed: int
+    reverb: int
+
+    def represent(self):
+        return f'{self.speed:>3}x{self.reverb:<2}'
+
+
+@dataclass
+class Attempt:
+    id: int
+    variant: Variant
+    stage: Stage
+    number: int
+    size: Optional[int] = None
+    status: Status = Status.RUNNING
+
+
+@dataclass
+class AttemptRecord:
+    variant: Variant
+    stage: Stage
+    status: Status
+    started_at: float
+    finished_at: Optional[float]
+    size: Optional[int]
+    error: Optional[str]
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.finished_at - self.started_at if self.finished_at is not None else None
+
+
+class Ledger:
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pid INTEGER NOT NULL,
+            started_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id INTEGER NOT NULL REFERENCES runs (id),
+            track TEXT NOT NULL,
+            speed INTEGER NOT NULL,
+            reverb INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            number INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            size INTEGER,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS attempts_by_variant ON attempts (track, speed, reverb, stage);
+        CREATE INDEX IF NOT EXISTS attempts_by_time ON attempts (stage, started_at);
+    """
+
+    def __init__(self, path: Path = config.LEDGER_PATH, max_attempts: int = config.LEDGER_MAX_ATTEMPTS, read_only: bool = False):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.run_id = None
+
+        # reading the history (e.g. reports) neither registers a run nor touches interrupted ones
+        if read_only:
+            self.connection = sqlite3.connect(f'{path.resolve().as_uri()}?mode=ro', uri=True, isolation_level=None, timeout=30)
+            return
+
+        self.connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.connection.executescript(self._SCHEMA)
+
+        self._fail_interrupted_runs()
+        self.run_id = self.connection.execute('INSERT INTO runs (pid, started_at) VALUES (?, ?)', (os.getpid(), time.time())).lastrowid
+
+    def close(self):
+        self.connection.close()
+
+    def start(self, variant: Variant, stage: Stage, started_at: Optional[float] = None) -> Attempt:
+        number = self.attempts(variant, stage) + 1
+        id = self.connection.execute(
+            'INSERT INTO attempts (run_id, track, speed, reverb, stage, number, status, started_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (self.run_id, variant.track, variant.speed, variant.reverb, stage.value, number, Status.RUNNING.value, started_at or time.time()),
+        ).lastrowid
+        return Attempt(id, variant, stage, number)
+
+    def succeed(self, attempt: Attempt, finished_at: Optional[float] = None):
+        self._finish(attempt, Status.SUCCEEDED, finished_at=finished_at)
+
+    def fail(self, attempt: Attempt, error: str, finished_at: Optional[float] = None):
+        self._finish(attempt, Status.FAILED, finished_at=finished_at, error=error)
+
+    def record(
+            self,
+            variant: Variant,
+            stage: Stage,
+            started_at: float,
+            finished_at: float,
+            size: Optional[int] = None,
+            error: Optional[str] = None,
+    ) -> Attempt:
+        attempt = self.start(variant, stage, started_at=started_at)
+        attempt.size = size
+
+        if error is None:
+            self.succeed(attempt, finished_at=finished_at)
+        else:
+            self.fail(attempt, error, finished_at=finished_at)
+
+        return attempt
+
+    @contextmanager
+    def attempt(self, variant: Variant, stage: Stage) -> Iterator[Attempt]:
+        attempt = self.start(variant, stage)
+
+        try:
+            yield attempt
+        except BaseException as e:
+            if attempt.status is Status.RUNNING:
+                self.fail(attempt, f'{type(e).__name__}: {e}')
+            raise
+
+        if attempt.status is Status.RUNNING:
+            self.succeed(attempt)
+
+    def attempts(self, variant: Variant, stage: Stage) -> int:
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM attempts WHERE run_id = ? AND track = ? AND speed = ? AND reverb = ? AND stage = ?',
+            (self.run_id, variant.track, variant.speed, variant.reverb, stage.value),
+        ).fetchone()[0]
+
+    def can_retry(self, variant: Variant, stage: Stage) -> bool:
+        return self.attempts(variant, stage) < self.max_attempts
+
+    def throughput(self, stage: Stage, since: float = 0) -> Optional[float]:
+        size, seconds = self.connection.execute(
+            'SELECT SUM(size), SUM(finished_at - started_at) FROM attempts WHERE stage = ? AND status = ? AND size IS NOT NULL AND started_at >= ?',
+            (stage.value, Status.SUCCEEDED.value, since),
+        ).fetchone()
+        return size / seconds if size and seconds else None
+
+    def history(self, since: float = 0, stage: Optional[Stage] = None) -> list[AttemptRecord]:
+        query = 'SELECT track, speed, reverb, stage, status, started_at, finished_at, size, error FROM attempts WHERE started_at >= ?'
+        args = [since]
+
+        if stage:
+            query += ' AND stage = ?'
+            args.append(stage.value)
+
+        return [
+            AttemptRecord(Variant(track, speed, reverb), Stage(stage), Status(status), started_at, finished_at, size, error)
+            for track, speed, reverb, stage, status, started_at, finished_at, size, error
+            in self.connection.execute(query + ' ORDER BY started_at', args)
+        ]
+
+    def _fail_interrupted_runs(self):
+        # attempts left running by a killed process will never finish on their own
+        running = self.connection.execute(
+            'SELECT DISTINCT runs.id, runs.pid FROM runs JOIN attempts ON attempts.run_id = runs.id WHERE attempts.status = ?',
+            (Status.RUNNING.value,),
+        ).fetchall()
+
+        for run_id, pid in running:
+            if not self._is_alive(pid):
+                self.connection.execute(
+                    'UPDATE attempts SET status = ?, error = ? WHERE run_id = ? AND status = ?',
+                    (Status.FAILED.value, 'Interrupted', run_id, Status.RUNNING.value),
+                )
+
+    @staticmethod
+    def _is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+
+        return True
+
+    def _finish(self, attempt: Attempt, status: Status, finished_at: Optional[float] = None, error: Optional[str] = None):
+        attempt.status = status
+        self.connection.execute(
+            'UPDATE attempts SET status = ?, finished_at = ?, size = ?, error = ? WHERE id = ?',
+            (status.value, finished_at or time.time(), attempt.size, error, attempt.id),
+        )
@@ -0,0 +1,69 @@
+import json
+import logging
+import math
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Self
+
+import ffmpeg
+
+from src import config
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Loudness:
+    integrated: float  # LUFS
+    true_peak: float  # dBTP
+    range: float  # LU
+
+    def represent(self) -> str:
+        return f'{self.integrated:.1f} LUFS, {self.true_peak:.1f} dBTP, LRA {self.range:.1f} LU'
+
+    def gain(
+            self,
+            speed: int,
+            reverb: int,
+            target: float = config.LOUDNESS_TARGET,
+            true_peak_limit: float = config.LOUDNESS_TRUE_PEAK_LIMIT,
+    ) -> float:
+        # renders resample the source and add reverb, both shift its loudness predictably enough to skip measuring every variant
+        if not (math.isfinite(self.integrated) and math.isfinite(self.true_peak)):
+            return 0.0
+
+        shift = config.LOUDNESS_SPEED_SHIFT * math.log2(speed / config.STANDARD_SPEED) + config.LOUDNESS_REVERB_SHIFT * reverb
+        gain = min(target - (self.integrated + shift), true_peak_limit - (self.true_peak + shift))
+        return round(gain, 1)
+
+    @classmethod
+    def measure(cls, path: Path) -> Self:
+        # EBU R128 analysis of the whole track in one decoding pass, `loudnorm` prints it as JSON at the end of the log
+        _, log = (
+            ffmpeg
+            .input(str(path))
+            .audio
+            .filter('loudnorm', print_format='json')
+            .output('-', f='null')
+            .global_args('-hide_banner', '-nostats')
+            .run(capture_stderr=True)
+        )
+        log = log.decode()
+        result = json.loads(log[log.rindex('{'):log.rindex('}') + 1])
+        return cls(float(result['input_i']), float(result['input_tp']), float(result['input_lra']))
+
+
+def analyze(track: Path, cache_path: Path) -> Loudness:
+    # the cache lives next to the track and is invalidated when the track is replaced
+    stat = track.stat()
+    key = f'{track.name}:{stat.st_size}:{stat.st_mtime_ns}'
+    cache = json.loads(cache_path.read_text()) if cache_path.exists() else {}
+
+    if key in cache:
+        return Loudness(**cache[key])
+
+    logger.info('Analysing loudness of the track')
+    loudness = Loudness.measure(track)
+    cache_path.write_text(json.dumps({key: asdict(loudness)}, indent=2) + '\n')
+    return loudness
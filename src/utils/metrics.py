@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Iterator, Optional
+
+from src.utils.ledger import Variant
+
+
+PROMETHEUS_PREFIX = 'nightcore'
+
+
+class MetricsFormat(Enum):
+    JSON_LINES = 'jsonl'
+    PROMETHEUS = 'prometheus'
+
+    @classmethod
+    @property
+    def DEFAULT(cls):
+        return cls.JSON_LINES
+
+
+@dataclass
+class Span:
+    name: str
+    started_at: float
+    finished_at: Optional[float] = None
+    labels: dict[str, str] = field(default_factory=dict)
+    values: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def seconds(self) -> Optional[float]:
+        return self.finished_at - self.started_at if self.finished_at is not None else None
+
+
+class Metrics:
+    def __init__(self):
+        self.spans: list[Span] = []
+
+    @contextmanager
+    def span(self, name: str, variant: Optional[Variant] = None, **labels: str) -> Iterator[Span]:
+        span = Span(name, time.time(), labels=self._labels(variant, labels))
+
+        try:
+            yield span
+        except BaseException:
+            span.labels['status'] = 'failed'
+            raise
+        finally:
+            span.finished_at = time.time()
+            span.labels.setdefault('status', 'succeeded')
+            self.spans.append(span)
+
+    def record(
+            self,
+            name: str,
+            started_at: float,
+            finished_at: float,
+            variant: Optional[Variant] = None,
+            failed: bool = False,
+            values: Optional[dict[str, float]] = None,
+            **labels: str,
+    ) -> Span:
+        labels = self._labels(variant, labels) | {'status': 'failed' if failed else 'succeeded'}
+        span = Span(name, started_at, finished_at, labels=labels, values={k: v for k, v in (values or {}).items() if v is not None})
+        self.spans.append(span)
+        return span
+
+    def export(self, path: Path, format: MetricsFormat = MetricsFormat.DEFAULT):
+        match format:
+            case MetricsFormat.JSON_LINES:
+                self._export_json_lines(path)
+            case MetricsFormat.PROMETHEUS:
+                self._export_prometheus(path)
+
+    def _export_json_lines(self, path: Path):
+        with path.open('a') as file:
+            for x in self.spans:
+                file.write(json.dumps({
+                    'name': x.name,
+                    'started_at': x.started_at,
+                    'seconds': x.seconds,
+                    **x.labels,
+                    **x.values,
+                }) + '\n')
+
+    def _export_prometheus(self, path: Path):
+        # later spans of the same series (retries) overwrite earlier ones, series must be unique in a textfile
+        series: dict[str, dict[tuple, float]] = {}
+
+        for x in self.spans:
+            labels = tuple(sorted(x.labels.items()))
+
+            for key, value in {'seconds': x.seconds, **x.values}.items():
+                series.setdefault(f'{PROMETHEUS_PREFIX}_{x.name}_{key}', {})[labels] = value
+
+        lines = []
+
+        for name, values in series.items():
+            lines.append(f'# TYPE {name} gauge')
+
+            for labels, value in values.items():
+                formatted_labels = ','.join(f'{k}="{self._escape_label_value(v)}"' for k, v in labels)
+                lines.append(f'{name}{{{formatted_labels}}} {value}')
+
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge')
+        lines.append(f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {time.time()}')
+
+        # node_exporter may read the file at any moment, so it has to be replaced atomically
+        temporary_path = path.with_name(f'.{path.name}.{os.getpid()}')
+        temporary_path.write_text('\n'.join(lines) + '\n')
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def _labels(variant: Optional[Variant], labels: dict[str, str]) -> dict[str, str]:
+        if variant:
+            labels = {'track': variant.track, 'speed': str(variant.speed), 'reverb': str(variant.reverb)} | labels
+
+        return dict(labels)
+
+    @staticmethod
+    def _escape_label_value(value: str) -> str:
+        return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+metrics = Metrics()
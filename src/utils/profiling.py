@@ -0,0 +1,118 @@
+import cProfile
+import os
+import pstats
+import signal
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from types import FrameType
+from typing import Iterator, Optional
+
+from src import config
+
+
+PROFILE_EXTENSION = 'prof'
+FOLDED_EXTENSION = 'folded'
+REPORT_EXTENSION = 'txt'
+MERGED_NAME = 'merged'
+
+
+class StackSampler:
+    # wall-clock samples, unlike cProfile this also shows where time is spent waiting (subprocesses, browser, HTTP)
+    def __init__(self, interval: float = config.PROFILE_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._previous_handler = None
+
+    def start(self):
+        self._previous_handler = signal.signal(signal.SIGALRM, self._sample)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self._previous_handler or signal.SIG_DFL)
+
+    def write(self, path: Path):
+        with path.open('w') as file:
+            for stack, count in self.samples.items():
+                file.write(f'{stack} {count}\n')
+
+    def _sample(self, signum, frame: Optional[FrameType]):
+        stack = []
+
+        while frame:
+            stack.append(f'{frame.f_code.co_qualname} ({Path(frame.f_code.co_filename).name}:{frame.f_code.co_firstlineno})')
+            frame = frame.f_back
+
+        if stack:
+            self.samples[';'.join(reversed(stack)).replace(' ', '_')] += 1
+
+
+@contextmanager
+def profile(directory: Optional[Path], name: str) -> Iterator[None]:
+    if directory is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    sampler = StackSampler()
+    sampler.start()
+    profiler.enable()
+
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+
+        # several workers of one step may finish at the same moment, so every part gets a unique name
+        part = f'{name}.{os.getpid()}.{time.monotonic_ns()}'
+        profiler.dump_stats(directory / f'{part}.{PROFILE_EXTENSION}')
+        sampler.write(directory / f'{part}.{FOLDED_EXTENSION}')
+
+
+def merge_step(directory: Path, name: str):
+    profiles = sorted(directory.glob(f'{name}.*.{PROFILE_EXTENSION}'))
+    folded = sorted(directory.glob(f'{name}.*.{FOLDED_EXTENSION}'))
+
+    if not profiles:
+        return
+
+    stats = pstats.Stats(*map(str, profiles))
+    stats.dump_stats(directory / f'{name}.{PROFILE_EXTENSION}')
+
+    with (directory / f'{name}.{REPORT_EXTENSION}').open('w') as file:
+        pstats.Stats(str(directory / f'{name}.{PROFILE_EXTENSION}'), stream=file).sort_stats('cumulative').print_stats(config.PROFILE_REPORT_LINES)
+        pstats.Stats(str(directory / f'{name}.{PROFILE_EXTENSION}'), stream=file).sort_stats('tottime').print_stats(config.PROFILE_REPORT_LINES)
+
+    samples = Counter()
+
+    for path in folded:
+        samples.update(_read_folded(path))
+
+    with (directory / f'{name}.{FOLDED_EXTENSION}').open('w') as file:
+        for stack, count in samples.items():
+            file.write(f'{stack} {count}\n')
+
+    for path in profiles + folded:
+        path.unlink()
+
+
+def merge_flame_graph(directory: Path, names: list[str]):
+    # each step becomes a root frame, so the whole run fits into one flame graph
+    with (directory / f'{MERGED_NAME}.{FOLDED_EXTENSION}').open('w') as file:
+        for name in names:
+            if (path := directory / f'{name}.{FOLDED_EXTENSION}').exists():
+                for stack, count in _read_folded(path).items():
+                    file.write(f'{name};{stack} {count}\n')
+
+
+def _read_folded(path: Path) -> Counter[str]:
+    samples = Counter()
+
+    for line in path.read_text().splitlines():
+        stack, _, count = line.rpartition(' ')
+        samples[stack] += int(count)
+
+    return samples
@@ -0,0 +1,78 @@
+import errno
+import hashlib
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional
+
+
+PARTIAL_MARKER = 'partial'
+
+
+def partial_name(path: Path, tag: Optional[str] = None) -> str:
+    # hidden names never match the nightcore name patterns, the extension is kept for `ffmpeg`
+    return f'.{path.stem}{f".{tag}" if tag else ""}.{PARTIAL_MARKER}{path.suffix}'
+
+
+def promote(path: Path, destination: Path):
+    # a rename is atomic, across file systems the copy is renamed into place only once it's complete
+    try:
+        path.replace(destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+        temporary_path = destination.with_name(f'.{destination.name}.{uuid.uuid4().hex}.{PARTIAL_MARKER}')
+
+        try:
+            shutil.copyfile(path, temporary_path)
+            temporary_path.replace(destination)
+        finally:
+            temporary_path.unlink(missing_ok=True)
+
+        path.unlink()
+
+
+class Scratch:
+    # intermediates of a track are written to fast local storage and only finished artifacts reach the working directory,
+    # without a scratch directory they are written to hidden partial files in the working directory itself
+    def __init__(self, working_directory: Path, directory: Optional[Path] = None):
+        self.working_directory = working_directory
+        self.path = directory / f'{working_directory.name}-{hashlib.sha1(bytes(working_directory)).hexdigest()[:8]}' if directory else working_directory
+        self.written = 0
+        self.promoted = 0
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._remove_partials()  # leftovers of interrupted runs
+
+    @property
+    def is_separate(self) -> bool:
+        return self.path != self.working_directory
+
+    @property
+    def saved(self) -> int:
+        # bytes that never had to be written to the working directory: segments and outputs of failed attempts
+        return self.written - self.promoted if self.is_separate else 0
+
+    def path_for(self, path: Path) -> Path:
+        return self.path / partial_name(path)
+
+    def promote(self, path: Path, destination: Path):
+        size = path.stat().st_size
+        promote(path, destination)
+        self.written += size
+        self.promoted += size
+
+    def discard(self, path: Path):
+        if not path.exists():
+            return
+
+        # intermediates of remote workers are in the working directory
+        if path.parent == self.path: self.written += path.stat().st_size
+        path.unlink()
+
+    def clear(self):
+        self._remove_partials()
+        if self.is_separate and not any(self.path.iterdir()): self.path.rmdir()
+
+    def _remove_partials(self):
+        for x in self.path.glob(f'.*.{PARTIAL_MARKER}*'): x.unlink(missing_ok=True)
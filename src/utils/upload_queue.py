@@ -0,0 +1,166 @@
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from enum import Enum
+from itertools import groupby
+from pathlib import Path
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from src import config
+
+
+class UploadStatus(Enum):
+    QUEUED = 'queued'
+    UPLOADED = 'uploaded'
+    FAILED = 'failed'
+
+
+@dataclass
+class QueuedUpload:
+    id: Optional[int]
+    directory: Path
+    track: str
+    path: Path
+    speed: int
+    reverb: int
+    speed_name: str
+    is_sped_up: bool
+    metadata: str
+    position: int
+    enqueued_at: Optional[float] = None
+
+
+class Quota:
+    # YouTube Data API quota is counted per day in Pacific time
+    def __init__(self, connection: sqlite3.Connection, limit: int = config.YOUTUBE_DAILY_QUOTA):
+        self.connection = connection
+        self.limit = limit
+
+    @staticmethod
+    def now() -> datetime:
+        return datetime.now(ZoneInfo(config.YOUTUBE_QUOTA_TIMEZONE))
+
+    def day(self) -> str:
+        return self.now().date().isoformat()
+
+    def used(self) -> int:
+        row = self.connection.execute('SELECT units FROM quota_usage WHERE day = ?', (self.day(),)).fetchone()
+        return row[0] if row else 0
+
+    def remaining(self) -> int:
+        return max(self.limit - self.used(), 0)
+
+    def can_spend(self, units: int) -> bool:
+        return units <= self.remaining()
+
+    def spend(self, units: int):
+        self.connection.execute(
+            'INSERT INTO quota_usage (day, units) VALUES (?, ?) ON CONFLICT (day) DO UPDATE SET units = units + excluded.units',
+            (self.day(), units),
+        )
+
+    def exhaust(self):
+        # the API disagrees with our count (e.g. uploads from another client), trust the API
+        self.spend(self.remaining())
+
+    def next_reset(self) -> datetime:
+        now = self.now()
+        return datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=now.tzinfo)
+
+    def seconds_until_reset(self) -> float:
+        return (self.next_reset() - self.now()).total_seconds()
+
+
+class UploadQueue:
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS upload_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            directory TEXT NOT NULL,
+            track TEXT NOT NULL,
+            path TEXT NOT NULL,
+            speed INTEGER NOT NULL,
+            reverb INTEGER NOT NULL,
+            speed_name TEXT NOT NULL,
+            is_sped_up INTEGER NOT NULL,
+            metadata TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            enqueued_at REAL NOT NULL,
+            status TEXT NOT NULL,
+            video_id TEXT,
+            error TEXT
+        );
+        CREATE TABLE IF NOT EXISTS quota_usage (
+            day TEXT PRIMARY KEY,
+            units INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path: Path = config.LEDGER_PATH, daily_quota: int = config.YOUTUBE_DAILY_QUOTA):
+        self.connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.connection.executescript(self._SCHEMA)
+        self.quota = Quota(self.connection, limit=daily_quota)
+
+    def close(self):
+        self.connection.close()
+
+    def enqueue(self, directory: Path, uploads: list[QueuedUpload]) -> bool:
+        # returns whether uploads were queued, a directory with a carried over speed set resumes it instead
+        queued = {
+            x[0] for x in self.connection.execute(
+                'SELECT path FROM upload_queue WHERE directory = ? AND status = ?',
+                (str(directory), UploadStatus.QUEUED.value),
+            )
+        }
+
+        if queued and queued <= {str(x.path) for x in uploads}:
+            return False
+
+        # the directory was processed again, so its queued uploads are outdated
+        self.connection.execute(
+            'DELETE FROM upload_queue WHERE directory = ? AND status = ?',
+            (str(directory), UploadStatus.QUEUED.value),
+        )
+
+        enqueued_at = time.time()
+        self.connection.executemany(
+            'INSERT INTO upload_queue (directory, track, path, speed, reverb, speed_name, is_sped_up, metadata, position, enqueued_at, status) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (str(x.directory), x.track, str(x.path), x.speed, x.reverb, x.speed_name, x.is_sped_up, x.metadata, x.position, enqueued_at, UploadStatus.QUEUED.value)
+                for x in uploads
+            ],
+        )
+        return True
+
+    def pending(self) -> list[list[QueuedUpload]]:
+        # whole speed sets in the order their tracks were queued, each set in its speed order
+        rows = self.connection.execute(
+            'SELECT id, directory, track, path, speed, reverb, speed_name, is_sped_up, metadata, position, enqueued_at FROM upload_queue '
+            'WHERE status = ? ORDER BY enqueued_at, directory, position',
+            (UploadStatus.QUEUED.value,),
+        ).fetchall()
+        uploads = [
+            QueuedUpload(id, Path(directory), track, Path(path), speed, reverb, speed_name, bool(is_sped_up), metadata, position, enqueued_at)
+            for id, directory, track, path, speed, reverb, speed_name, is_sped_up, metadata, position, enqueued_at in rows
+        ]
+        return [list(x) for _, x in groupby(uploads, key=lambda x: x.directory)]
+
+    def is_started(self, upload: QueuedUpload) -> bool:
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM upload_queue WHERE directory = ? AND enqueued_at = ? AND status = ?',
+            (str(upload.directory), upload.enqueued_at, UploadStatus.UPLOADED.value),
+        ).fetchone()[0] > 0
+
+    def mark_uploaded(self, upload: QueuedUpload, video_id: str):
+        self.connection.execute(
+            'UPDATE upload_queue SET status = ?, video_id = ? WHERE id = ?',
+            (UploadStatus.UPLOADED.value, video_id, upload.id),
+        )
+
+    def mark_failed(self, upload: QueuedUpload, error: str, video_id: Optional[str] = None):
+        self.connection.execute(
+            'UPDATE upload_queue SET status = ?, video_id = ?, error = ? WHERE id = ?',
+            (UploadStatus.FAILED.value, video_id, error, upload.id),
+        )
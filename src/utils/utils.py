@@ -1,3 +1,7 @@
 class ExitCode:
     GENERAL_ERROR = 1
     INCORRECT_USAGE = 2
+
+
+class StepError(Exception):
+    ...
@@ -1,3 +1,4 @@
+from fractions import Fraction
 from pathlib import Path
 from typing import Iterable, Optional
 
@@ -39,6 +40,9 @@ class WorkingDirectory:
 
         return paths[0] if paths else None
 
+    def get_track_name(self) -> str:
+        return self.get_track_path(raise_if_not_exists=True).stem
+
     def get_cover_path(self, raise_if_not_exists=False) -> Optional[Path]:
         paths = [x for x in self.path.iterdir() if self._is_cover_path(x)]
 
@@ -65,20 +69,35 @@ class WorkingDirectory:
 
         return paths
 
+    def get_ratio_video_paths(self) -> list[Path]:
+        return [x for x in self.path.iterdir() if self._is_ratio_video_path(x)]
+
     def get_metadata(self) -> Metadata:
         return Metadata.from_string(self.get_cover_path(raise_if_not_exists=True).stem)
 
+    def get_loudness_cache_path(self) -> Path:
+        return self.path / config.LOUDNESS_CACHE_NAME
+
     def speed_and_reverb_to_path(self, speed, reverb, extension) -> Path:
         return self.path / f'{speed}{config.SPEED_REVERB_NAME_SEPARATOR}{reverb}.{extension}'
 
     @staticmethod
     def path_to_speed_and_reverb(path: Path) -> (int, int):
-        return tuple(map(int, path.stem.split(config.SPEED_REVERB_NAME_SEPARATOR)))
+        return tuple(map(int, path.stem.split(config.SPEED_REVERB_NAME_SEPARATOR)[:2]))
+
+    @staticmethod
+    def reduce_ratio(ratio: float) -> Fraction:
+        return Fraction(ratio).limit_denominator(config.RATIO_NAME_MAX_DENOMINATOR)
+
+    @staticmethod
+    def video_path_with_ratio(path: Path, ratio: float) -> Path:
+        ratio = WorkingDirectory.reduce_ratio(ratio)
+        return path.with_stem(f'{path.stem}{config.SPEED_REVERB_NAME_SEPARATOR}{ratio.numerator}{config.RATIO_NAME_SEPARATOR}{ratio.denominator}')
 
     @staticmethod
     def _is_track_path(path: Path):
         return (
-                path.is_file() and
+                WorkingDirectory._is_visible_file(path) and
                 has_any_of_extensions(path, config.AUDIO_EXTENSIONS) and
                 not WorkingDirectory._has_nightcore_stem(path)
         )
@@ -86,14 +105,14 @@ class WorkingDirectory:
     @staticmethod
     def _is_cover_path(path: Path):
         return (
-                path.is_file() and
+                WorkingDirectory._is_visible_file(path) and
                 has_any_of_extensions(path, config.COVER_EXTENSIONS)
         )
 
     @staticmethod
     def _is_nightcore_path(path: Path):
         return (
-                path.is_file() and
+                WorkingDirectory._is_visible_file(path) and
                 has_any_of_extensions(path, config.AUDIO_EXTENSIONS) and
                 WorkingDirectory._has_nightcore_stem(path)
         )
@@ -101,11 +120,24 @@ class WorkingDirectory:
     @staticmethod
     def _is_video_path(path: Path):
         return (
-                path.is_file() and
+                WorkingDirectory._is_visible_file(path) and
                 has_any_of_extensions(path, config.VIDEO_EXTENSIONS) and
                 WorkingDirectory._has_nightcore_stem(path)
         )
 
+    @staticmethod
+    def _is_ratio_video_path(path: Path):
+        return (
+                WorkingDirectory._is_visible_file(path) and
+                has_any_of_extensions(path, config.VIDEO_EXTENSIONS) and
+                bool(config.RATIO_VIDEO_NAME_PATTERN.fullmatch(path.stem))
+        )
+
+    @staticmethod
+    def _is_visible_file(path: Path):
+        # hidden files are partials of unfinished artifacts, e.g. a render still downloading
+        return path.is_file() and not path.name.startswith('.')
+
     @staticmethod
     def _has_nightcore_stem(path: Path):
         return bool(config.NIGHTCORE_NAME_PATTERN.fullmatch(path.stem))
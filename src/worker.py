@@ -0,0 +1,65 @@
+import logging
+import multiprocessing
+from pathlib import Path
+from typing import Optional
+
+import click
+
+from src.steps.nightcore_to_video import work
+from src.utils.job_queue import JobQueue, worker_id
+
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+def run_worker(queue_directory: Path, idle_timeout: Optional[float], scratch_directory: Optional[Path]):
+    worker = worker_id()
+    logger.info(f'{worker}: Waiting for jobs in `{queue_directory}`')
+    work(JobQueue(queue_directory), worker, idle_timeout=idle_timeout, scratch_directory=scratch_directory)
+
+
+@click.command(help="""
+Encode videos of the `nightcore-to-video` step submitted to a shared job queue.
+
+<queue-directory>: Queue directory on a file system shared with the pipeline, working directories must be mounted at the same paths
+""")
+@click.argument(
+    'queue_directory',
+    type=click.Path(path_type=Path, file_okay=False, writable=True),
+    metavar='[queue-directory]',
+)
+@click.option(
+    '--processes',
+    '-n',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help='Number of worker processes, each of them claims jobs on its own like a separate host',
+    metavar='',
+)
+@click.option(
+    '--idle-timeout',
+    type=click.FloatRange(min=0),
+    help='Exit after not getting any job for the number of seconds instead of waiting forever',
+    metavar='',
+)
+@click.option(
+    '--scratch-directory',
+    type=click.Path(path_type=Path, exists=True, file_okay=False, writable=True),
+    help='Encode into fast local storage and copy only finished videos to the shared file system',
+    metavar='',
+)
+def worker(queue_directory: Path, processes: int, idle_timeout: Optional[float], scratch_directory: Optional[Path]):
+    queue_directory = queue_directory.resolve()
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(queue_directory, idle_timeout, scratch_directory))
+        for _ in range(processes)
+    ]
+
+    for x in workers: x.start()
+    for x in workers: x.join()
+
+
+if __name__ == '__main__':
+    worker()